@@ -9,6 +9,63 @@ from datetime import datetime
 
 logger = logging.getLogger(__name__)
 
+def estimate_tokens(text):
+    """Roughly estimate the token count of a text (about four characters per token)."""
+    return (len(text) + 3) // 4 if text else 0
+
+class MemoryLog:
+    """Append-only sequence that shares a prefix with another sequence.
+
+    A log created from `parent` sees the first `len(parent)` entries of it at
+    creation time and stores only entries appended afterwards, so forking a
+    history is O(1) and each branch only grows with its own divergence. The
+    parent may keep growing; later parent entries are not visible here.
+    """
+
+    __slots__ = ('parent', 'base', 'entries')
+
+    def __init__(self, parent=None):
+        self.parent = parent if parent is not None else []
+        self.base = len(self.parent)
+        self.entries = []
+
+    def fork(self):
+        """Create a branch sharing this log's current entries."""
+        return MemoryLog(self)
+
+    def append(self, entry):
+        self.entries.append(entry)
+
+    def __len__(self):
+        return self.base + len(self.entries)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("memory index out of range")
+        if index < self.base:
+            return self.parent[index]
+        return self.entries[index - self.base]
+
+    def __iter__(self):
+        for i in range(self.base):
+            yield self.parent[i]
+        yield from self.entries
+
+    def __reversed__(self):
+        yield from reversed(self.entries)
+        for i in range(self.base - 1, -1, -1):
+            yield self.parent[i]
+
+    def __add__(self, other):
+        return list(self) + list(other)
+
+    def __eq__(self, other):
+        return len(self) == len(other) and all(a == b for a, b in zip(self, other))
+
 class Agent:
     """A simulated persona that can interact and respond to messages."""
     
@@ -18,6 +75,10 @@ class Agent:
         self.memory = []
         self.context = []
         self.accessible_agents = []
+        self.memory_index = None
+        self.context_version = 0
+        self.last_usage = {}
+        self.usage_totals = {'requests': 0, 'prompt_tokens': 0, 'cached_tokens': 0}
         
     def define(self, key, value):
         """Define a configuration value for the agent."""
@@ -29,9 +90,31 @@ class Agent:
             self.config[key] = []
         self.config[key].extend(values)
 
+    def fork(self):
+        """Create a copy of the agent whose memory shares all entries recorded so far."""
+        agent = Agent(self.name, dict(self.config))
+        agent.memory = MemoryLog(self.memory)
+        agent.context = list(self.context)
+        agent.context_version = self.context_version
+        if self.memory_index is not None:
+            agent.memory_index = self.memory_index.fork()
+        return agent
+
+    def _remember(self, entry):
+        """Append a memory entry, indexing it when semantic memory is enabled."""
+        self.memory.append(entry)
+        if self.memory_index is not None:
+            self.memory_index.add([entry])
+
+    def enable_semantic_memory(self, embedder=None, recent_limit=3, relevant_limit=3):
+        """Retrieve older memories by similarity to the latest input, in addition to recent ones."""
+        from memory import SemanticMemoryIndex
+        self.memory_index = SemanticMemoryIndex(embedder, recent_limit, relevant_limit)
+        self.memory_index.add(self.memory)
+
     def listen(self, message, source=None):
         """Process an incoming message."""
-        self.memory.append({
+        self._remember({
             'type': 'input',
             'content': message,
             'source': source,
@@ -40,7 +123,7 @@ class Agent:
         
     def see(self, image_description, source=None):
         """Process a visual input."""
-        self.memory.append({
+        self._remember({
             'type': 'visual',
             'content': image_description,
             'source': source,
@@ -49,16 +132,21 @@ class Agent:
 
     def think(self, thought):
         """Record an internal thought."""
-        self.memory.append({
+        self._remember({
             'type': 'thought',
             'content': thought,
             'timestamp': datetime.now().isoformat()
         })
 
-    def change_context(self, context):
-        """Update the agent's context."""
+    def change_context(self, context, version=None):
+        """Update the agent's context.
+
+        The context itself is only rendered in the system prompt; memory records
+        a short note that it changed so the description is not repeated per turn.
+        """
         self.context = context
-        self.think(f"Understanding new context: {' '.join(context)}")
+        self.context_version = version if version is not None else self.context_version + 1
+        self.think(f"The environment context changed (version {self.context_version}).")
 
     def make_agent_accessible(self, agent):
         """Make another agent accessible for interaction."""
@@ -66,7 +154,13 @@ class Agent:
             self.accessible_agents.append(agent)
 
     def get_prompt(self):
-        """Generate the complete prompt for the agent."""
+        """Generate the complete prompt for the agent.
+
+        Sections are ordered from most to least stable (persona, instructions,
+        participants, then the current context) so that a context change
+        leaves the longest possible prefix unchanged for provider-side prompt
+        caching.
+        """
         prompt = f"""You are {self.name}, with the following characteristics:
 
 Age: {self.config.get('age')}
@@ -78,18 +172,6 @@ Personality traits:
         for trait in self.config.get('personality_traits', []):
             prompt += f"- {trait['trait']}\n"
 
-        # Add current context
-        if self.context:
-            prompt += "\nCurrent context and environment:\n"
-            for ctx in self.context:
-                prompt += f"- {ctx}\n"
-
-        # Add information about other participants
-        if self.accessible_agents:
-            prompt += "\nOther participants in the conversation:\n"
-            for agent in self.accessible_agents:
-                prompt += f"- {agent.name} ({agent.config.get('occupation')})\n"
-
         prompt += """
 Instructions:
 1. Always stay in character, maintaining your personality traits and perspective
@@ -100,18 +182,48 @@ Instructions:
 
 Please respond in character, maintaining these traits and characteristics.
 """
+
+        # Add information about other participants
+        if self.accessible_agents:
+            prompt += "\nOther participants in the conversation:\n"
+            for agent in self.accessible_agents:
+                prompt += f"- {agent.name} ({agent.config.get('occupation')})\n"
+
+        # Add current context
+        if self.context:
+            prompt += "\nCurrent context and environment:\n"
+            for ctx in self.context:
+                prompt += f"- {ctx}\n"
+
         return prompt
 
     def get_recent_memory(self, limit=5):
         """Get recent memory entries."""
         return self.memory[-limit:] if self.memory else []
 
-    def generate_response(self, openai_client, temperature=0.7):
-        """Generate a response using OpenAI."""
+    def get_relevant_memory(self):
+        """Get recent memory plus the older entries most similar to the latest input."""
+        if self.memory_index is None:
+            return self.get_recent_memory()
+        recent_start = max(len(self.memory) - self.memory_index.recent_limit, 0)
+        query = next((mem['content'] for mem in reversed(self.memory) if mem['type'] == 'input'), None)
+        positions = self.memory_index.search(query, exclude_from=recent_start)
+        return [self.memory[i] for i in sorted(positions)] + self.memory[recent_start:]
+
+    def speak(self, message):
+        """Record a response the agent has given."""
+        self._remember({
+            'type': 'output',
+            'content': message,
+            'timestamp': datetime.now().isoformat()
+        })
+
+    def build_messages(self):
+        """Build the chat messages sent to the model for the next response."""
         messages = [{"role": "system", "content": self.get_prompt()}]
         
         # Add recent memory for context
-        for mem in self.get_recent_memory():
+        for mem in self.get_relevant_memory():
             if mem['type'] == 'input':
                 messages.append({
                     "role": "user",
@@ -127,15 +239,92 @@ Please respond in character, maintaining these traits and characteristics.
                     "role": "assistant",
                     "content": f"[Internal thought: {mem['content']}]"
                 })
+            elif mem['type'] == 'output':
+                messages.append({
+                    "role": "assistant",
+                    "content": mem['content']
+                })
+        return messages
+
+    def get_request_params(self, temperature=0.7):
+        """Get the chat completion parameters for the next response."""
+        return {
+            "model": "gpt-4",
+            "messages": self.build_messages(),
+            "temperature": temperature,
+            "max_tokens": 500
+        }
+
+    def record_usage(self, messages, usage=None):
+        """Record token accounting for the last request.
+
+        `context_tokens` is the estimated share of the prompt spent on the
+        environment context, which is sent once per request. `cached_tokens`
+        is the prompt prefix the provider served from its prompt cache.
+        """
+        prompt_tokens = getattr(usage, 'prompt_tokens', None)
+        if prompt_tokens is None:
+            prompt_tokens = sum(estimate_tokens(m['content']) for m in messages if isinstance(m['content'], str))
+        cached_tokens = getattr(getattr(usage, 'prompt_tokens_details', None), 'cached_tokens', None) or 0
+        self.last_usage = {
+            'prompt_tokens': prompt_tokens,
+            'completion_tokens': getattr(usage, 'completion_tokens', None),
+            'cached_tokens': cached_tokens,
+            'context_tokens': sum(estimate_tokens(ctx) for ctx in self.context),
+            'context_version': self.context_version
+        }
+        self.usage_totals['requests'] += 1
+        self.usage_totals['prompt_tokens'] += prompt_tokens
+        self.usage_totals['cached_tokens'] += cached_tokens
+        return self.last_usage
+
+    def cache_hit_rate(self):
+        """Get the share of prompt tokens served from the provider's prompt cache."""
+        if not self.usage_totals['prompt_tokens']:
+            return 0.0
+        return self.usage_totals['cached_tokens'] / self.usage_totals['prompt_tokens']
 
+    def request_response(self, openai_client, temperature=0.7, timeout=None):
+        """Request a response without recording usage.
+
+        Returns the response text, the request messages and the usage, so the
+        caller can `record_usage` only for responses it actually uses.
+        """
+        params = self.get_request_params(temperature)
+        if timeout is not None:
+            response = openai_client.chat.completions.create(**params, timeout=timeout)
+        else:
+            response = openai_client.chat.completions.create(**params)
+        return response.choices[0].message.content, params['messages'], getattr(response, 'usage', None)
+
+    def generate_response(self, openai_client, temperature=0.7, timeout=None):
+        """Generate a response using OpenAI, optionally bounded by a request timeout in seconds."""
         try:
-            response = openai_client.chat.completions.create(
-                model="gpt-4",
-                messages=messages,
-                temperature=temperature,
-                max_tokens=500
-            )
-            return response.choices[0].message.content
+            content, messages, usage = self.request_response(openai_client, temperature, timeout)
+            self.record_usage(messages, usage)
+            return content
         except Exception as e:
+            self.last_usage = {}
             logger.error(f"Error generating response: {e}")
             return "I apologize, but I am unable to respond at the moment."
+
+    async def stream_response(self, async_openai_client, temperature=0.7):
+        """Stream a response using an async OpenAI client, yielding text deltas."""
+        params = self.get_request_params(temperature)
+        usage = None
+        try:
+            stream = await async_openai_client.chat.completions.create(
+                **params,
+                stream=True,
+                stream_options={"include_usage": True}
+            )
+            async for chunk in stream:
+                if getattr(chunk, 'usage', None):
+                    usage = chunk.usage
+                if chunk.choices and chunk.choices[0].delta.content:
+                    yield chunk.choices[0].delta.content
+            self.record_usage(params['messages'], usage)
+        except Exception as e:
+            self.last_usage = {}
+            logger.error(f"Error streaming response: {e}")
+            yield "I apologize, but I am unable to respond at the moment."
@@ -2,18 +2,83 @@ import streamlit as st
 import os
 from datetime import datetime
 import tempfile
+import hashlib
+import httpx
 from openai import OpenAI
 from dotenv import load_dotenv
 import base64
+import uuid
 import config
+from session_store import FileSessionStore
+from hedging import HedgingPolicy
+from cassette import CassetteClient
+from gateway import LLMGateway, BATCH
+from survey import SurveyQuestion, run_survey
+import profiler
 from utils import ChatEnvironment, create_character, save_chat_history, load_chat_history
+from agent import MemoryLog
 import utils
 
 # Load environment variables
 load_dotenv()
 
-# Initialize OpenAI client
-client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+# Initialize OpenAI client, reusing one HTTP connection pool for the whole process
+@st.cache_resource
+def get_openai_client():
+    """Get the process-wide OpenAI client."""
+    limits = httpx.Limits(
+        max_connections=config.LLM_GATEWAY_WORKERS,
+        max_keepalive_connections=config.LLM_GATEWAY_WORKERS
+    )
+    return OpenAI(api_key=os.getenv("OPENAI_API_KEY"), http_client=httpx.Client(limits=limits))
+
+# Record to or replay from a cassette if configured
+@st.cache_resource
+def get_cassette_client():
+    """Get the process-wide cassette client so replay position survives reruns."""
+    if config.CASSETTE_MODE == "replay":
+        return CassetteClient(config.CASSETTE_PATH, "replay")
+    return CassetteClient(config.CASSETTE_PATH, "record", get_openai_client())
+
+cassette_error = None
+if config.CASSETTE_PATH:
+    try:
+        client = get_cassette_client()
+    except FileNotFoundError as e:
+        cassette_error = str(e)
+        client = None
+else:
+    client = get_openai_client()
+
+# Hedged requests share latency statistics across sessions
+@st.cache_resource
+def get_hedging_policy():
+    """Get the process-wide hedging policy, kept across reruns."""
+    return HedgingPolicy(hedge_percentile=config.HEDGE_PERCENTILE)
+
+# All sessions share one gateway so LLM calls are queued fairly across users.
+# Hedging happens inside the gateway so it times execution, not queue waits.
+@st.cache_resource
+def get_llm_gateway():
+    """Get the process-wide LLM gateway."""
+    hedging = get_hedging_policy() if config.HEDGE_PERCENTILE else None
+    return LLMGateway(client, workers=config.LLM_GATEWAY_WORKERS, hedging=hedging)
+
+gateway = get_llm_gateway() if client else None
+
+# Shared session store so sessions can move between workers
+@st.cache_resource
+def get_session_store():
+    """Get the process-wide session store, kept across reruns."""
+    return FileSessionStore(config.SESSION_STORE_DIR)
+
+session_store = get_session_store() if config.SESSION_STORE_DIR else None
+
+# Opt-in per-rerun profiling, shared by all sessions
+@st.cache_resource
+def get_rerun_profiler():
+    """Get the process-wide rerun profiler."""
+    return profiler.RerunProfiler()
 
 # Custom CSS
 def load_css():
@@ -125,17 +190,128 @@ def init_session_state():
         st.session_state.chat_env_description = ""
     if 'temperature' not in st.session_state:
         st.session_state.temperature = 0.7
+    if 'last_turn_usage' not in st.session_state:
+        st.session_state.last_turn_usage = []
+    if 'survey_results' not in st.session_state:
+        st.session_state.survey_results = None
+    if 'session_id' not in st.session_state:
+        st.session_state.session_id = st.query_params.get("session") or uuid.uuid4().hex
+        st.query_params["session"] = st.session_state.session_id
+        st.session_state.branches = {}
+        st.session_state.current_branch = "main"
+        st.session_state.branch_store_key = st.session_state.session_id
+        if session_store:
+            restore_session(st.session_state.session_id)
+
+def characters_in(environment):
+    """Get the persona types of the agents in an environment."""
+    agent_names = {agent.name for agent in environment.agents}
+    return [char for char, char_config in config.CHARACTERS.items() if char_config["name"] in agent_names]
+
+def restore_session(session_id):
+    """Restore a persisted environment, chat history and conversation branches into session state.
+
+    The session key holds the first branch and the branch index; every other
+    branch is stored under its own key.
+    """
+    environment, chat_history, metadata = session_store.load_with_metadata(session_id)
+    if environment is None:
+        return
+    st.session_state.environment = environment
+    st.session_state.chat_history = chat_history or []
+    st.session_state.chat_env_description = environment.description
+    st.session_state.selected_characters = characters_in(environment)
+    metadata = metadata or {}
+    for name, store_key in metadata.get("branches", {}).items():
+        if store_key == session_id:
+            st.session_state.current_branch = name
+            continue
+        branch_environment, branch_history = session_store.load(store_key)
+        if branch_environment is None:
+            continue
+        st.session_state.branches[name] = {
+            "environment": branch_environment,
+            "chat_history": branch_history or [],
+            "chat_env_description": branch_environment.description,
+            "selected_characters": characters_in(branch_environment),
+            "store_key": store_key
+        }
+    current = metadata.get("current_branch")
+    if current in st.session_state.branches and current != st.session_state.current_branch:
+        switch_branch(current, persist=False)
+
+def save_current_branch():
+    """Store the active conversation under the current branch name."""
+    st.session_state.branches[st.session_state.current_branch] = {
+        "environment": st.session_state.environment,
+        "chat_history": st.session_state.chat_history,
+        "chat_env_description": st.session_state.chat_env_description,
+        "selected_characters": st.session_state.selected_characters,
+        "store_key": st.session_state.branch_store_key
+    }
+
+def switch_branch(name, persist=True):
+    """Make a stored branch the active conversation."""
+    save_current_branch()
+    branch = st.session_state.branches[name]
+    st.session_state.environment = branch["environment"]
+    st.session_state.chat_history = branch["chat_history"]
+    st.session_state.chat_env_description = branch["chat_env_description"]
+    st.session_state.selected_characters = branch["selected_characters"]
+    st.session_state.branch_store_key = branch["store_key"]
+    st.session_state.current_branch = name
+    if persist:
+        save_branch_index()
+
+def fork_branch(name):
+    """Fork the active conversation into a new branch and switch to it.
+
+    History up to the fork is shared with the original branch, not copied.
+    """
+    save_current_branch()
+    if st.session_state.environment:
+        st.session_state.environment = st.session_state.environment.fork(name)
+    st.session_state.chat_history = MemoryLog(st.session_state.chat_history)
+    st.session_state.branch_store_key = f"{st.session_state.session_id}-b{uuid.uuid4().hex[:8]}"
+    st.session_state.current_branch = name
+    if session_store and st.session_state.environment:
+        session_store.save(
+            st.session_state.branch_store_key,
+            st.session_state.environment,
+            st.session_state.chat_history
+        )
+    save_branch_index()
+
+def save_branch_index():
+    """Persist the branch names, their store keys and the active branch with the first branch."""
+    if not session_store:
+        return
+    save_current_branch()
+    session_id = st.session_state.session_id
+    root = next((b for b in st.session_state.branches.values() if b["store_key"] == session_id), None)
+    if root is None or root["environment"] is None:
+        return
+    session_store.save(session_id, root["environment"], root["chat_history"], {
+        "branches": {name: branch["store_key"] for name, branch in st.session_state.branches.items()},
+        "current_branch": st.session_state.current_branch
+    })
 
 def save_uploaded_image(uploaded_file):
-    """Save uploaded image to a temporary file and return the path."""
+    """Save uploaded image to a temporary file and return the path.
+
+    The file is named after a hash of its content, so the same image always
+    gets the same path and requests mentioning it can be replayed.
+    """
     if uploaded_file is not None:
-        # Create a temporary file
-        temp_dir = tempfile.mkdtemp()
-        temp_path = os.path.join(temp_dir, uploaded_file.name)
+        data = uploaded_file.getbuffer()
+        upload_dir = os.path.join(tempfile.gettempdir(), "persona_simulator_uploads")
+        os.makedirs(upload_dir, exist_ok=True)
+        digest = hashlib.sha256(data).hexdigest()[:16]
+        temp_path = os.path.join(upload_dir, f"{digest}{utils.get_file_extension(uploaded_file.name)}")
         
         # Save the uploaded file
         with open(temp_path, "wb") as f:
-            f.write(uploaded_file.getbuffer())
+            f.write(data)
             
         # Convert to base64
         base64_image = utils.image_to_base64(temp_path)
@@ -150,13 +326,66 @@ def create_or_update_environment(selected_chars, env_description):
         description=env_description
     )
     
-    # Set the environment context for all agents
-    if env_description:
-        env.broadcast_context(f"""Current environment/context: {env_description}
-Please consider this context in all your responses and interactions.""")
-    
     return env
 
+def run_population_survey(question, size):
+    """Run a survey through the gateway at batch priority, so chat turns of all users go first."""
+    progress = st.progress(0.0, text="Surveying respondents...")
+    results = run_survey(
+        question,
+        size,
+        gateway.client_for(st.session_state.session_id, priority=BATCH),
+        temperature=st.session_state.temperature,
+        on_result=lambda results, persona, answer: progress.progress(results.total / size)
+    )
+    progress.empty()
+    st.session_state.survey_results = results.summary()
+
+def render_survey_panel():
+    """Show the population survey form and the latest results."""
+    with st.expander("Population Survey"):
+        text = st.text_input("Question:", key="survey_question")
+        options = [o.strip() for o in st.text_input("Answer options (comma-separated):", key="survey_options").split(",")]
+        options = [o for o in options if o]
+        size = st.number_input("Respondents:", min_value=1, max_value=1000, value=50, step=10)
+        if st.button("Run Survey", disabled=not text or not options):
+            run_population_survey(SurveyQuestion(text, options), int(size))
+        results = st.session_state.survey_results
+        if results:
+            st.caption(f"{results['total']} respondents")
+            for answer, share in results["shares"].items():
+                st.text(f"{share:6.1%}  {answer}")
+
+def render_cassette_mismatches(cassette_client):
+    """Show requests that were not found in the replayed cassette."""
+    mismatches = cassette_client.mismatches
+    st.error(f"{len(mismatches)} request(s) not found in cassette {cassette_client.path}; "
+             "those personas answered with a fallback message.")
+    with st.expander("Cassette mismatches"):
+        for mismatch in mismatches[-10:]:
+            st.text(f"{mismatch['key'][:12]}: {mismatch['reason']}")
+
+def render_profiler_summary(rerun_profiler):
+    """Show the slowest profiled reruns in the sidebar."""
+    st.subheader("Profiler")
+    slowest = rerun_profiler.slowest()
+    st.caption(f"{rerun_profiler.reruns_profiled} reruns profiled; slowest {len(slowest)} kept")
+    for record in slowest:
+        with st.expander(f"Rerun {record['id']}: {record['duration'] * 1000:.0f} ms ({record['started']})"):
+            st.write(f"**Allocation growth:** {record['memory_growth'] / 1024:.1f} KiB")
+            st.write("**Top functions (cumulative):**")
+            for func in record['top_functions'][:8]:
+                st.text(f"{func['cumulative_time'] * 1000:8.1f} ms  {func['calls']:>6}  {func['function']}")
+            st.write("**Top allocations:**")
+            for alloc in record['allocations'][:5]:
+                st.text(f"{alloc['size_diff'] / 1024:+8.1f} KiB  {alloc['location']}")
+            st.download_button(
+                "Download profile",
+                data=record['dump'],
+                file_name=f"rerun_{record['id']}.prof",
+                key=f"profile_download_{record['id']}"
+            )
+
 def main():
     st.set_page_config(
         page_title="Persona Simulator",
@@ -166,6 +395,10 @@ def main():
     
     # Load custom CSS
     load_css()
+
+    if cassette_error:
+        st.error(f"Cannot replay LLM calls: {cassette_error}")
+        st.stop()
     
     init_session_state()
 
@@ -214,6 +447,18 @@ def main():
             step=0.1,
             help="Higher values make the output more random, lower values make it more focused and deterministic."
         )
+        if st.session_state.last_turn_usage:
+            prompt_tokens = sum(u.get('prompt_tokens') or 0 for u in st.session_state.last_turn_usage)
+            context_tokens = sum(u.get('context_tokens') or 0 for u in st.session_state.last_turn_usage)
+            cached_tokens = sum(u.get('cached_tokens') or 0 for u in st.session_state.last_turn_usage)
+            st.caption(f"Last turn: {prompt_tokens} prompt tokens ({cached_tokens} cached), "
+                       f"~{context_tokens} for the environment context (sent once per request)")
+            if st.session_state.environment:
+                st.caption(f"Prompt cache hit rate: {st.session_state.environment.cache_hit_rate():.0%}")
+        gateway_metrics = gateway.metrics()
+        st.caption(f"LLM gateway: {gateway_metrics['queue_depth']['interactive']} queued, "
+                   f"{gateway_metrics['queue_depth']['batch']} batch queued, "
+                   f"{gateway_metrics['in_flight']} in flight, p95 wait {gateway_metrics['wait_p95']:.1f}s")
 
         # Environment description
         st.subheader("Environment Description")
@@ -228,10 +473,7 @@ def main():
         if new_env_description != st.session_state.chat_env_description:
             st.session_state.chat_env_description = new_env_description
             if st.session_state.environment and new_env_description:
-                st.session_state.environment.broadcast_context(
-                    f"""Current environment/context: {new_env_description}
-                    Please consider this context in all your responses and interactions."""
-                )
+                st.session_state.environment.broadcast_context(new_env_description)
 
         # Save/Load chat history
         st.subheader("Chat History")
@@ -249,6 +491,30 @@ def main():
             st.session_state.chat_history = load_chat_history(uploaded_file)
             st.success("Chat history loaded!")
 
+        # Conversation branches
+        st.subheader("Branches")
+        branch_names = list(dict.fromkeys([*st.session_state.branches, st.session_state.current_branch]))
+        selected_branch = st.selectbox(
+            "Active branch:",
+            branch_names,
+            index=branch_names.index(st.session_state.current_branch)
+        )
+        if selected_branch != st.session_state.current_branch:
+            switch_branch(selected_branch)
+            st.rerun()
+        new_branch = st.text_input("New branch name:", help="Try an alternative from this point in the conversation.")
+        if st.button("Fork Conversation", disabled=not new_branch or new_branch in branch_names):
+            fork_branch(new_branch)
+            st.rerun()
+
+        render_survey_panel()
+
+        if config.CASSETTE_PATH and client.mode == "replay" and client.mismatches:
+            render_cassette_mismatches(client)
+
+        if profiler.is_enabled(st.query_params):
+            render_profiler_summary(get_rerun_profiler())
+
     # Main chat interface
     st.title("Persona Simulator")
 
@@ -259,7 +525,8 @@ def main():
     # Create or update environment when characters are selected
     if selected_chars:
         if (not st.session_state.environment or 
-            set(selected_chars) != {char.name for char in st.session_state.environment.agents}):
+            {config.CHARACTERS[char]["name"] for char in selected_chars} !=
+            {agent.name for agent in st.session_state.environment.agents}):
             st.session_state.environment = create_or_update_environment(
                 selected_chars,
                 st.session_state.chat_env_description
@@ -311,11 +578,14 @@ def main():
             # Get responses from characters
             responses = st.session_state.environment.process_message(
                 message=user_input,
-                openai_client=client,
+                openai_client=gateway.client_for(st.session_state.session_id),
                 temperature=st.session_state.temperature,
-                image_path=image_path
+                image_path=image_path,
+                deadline=config.TURN_DEADLINE
             )
             
+            st.session_state.last_turn_usage = [r["usage"] for r in responses if r.get("usage")]
+
             # Add responses to chat history
             for response in responses:
                 st.session_state.chat_history.append({
@@ -325,10 +595,21 @@ def main():
                     "character_type": response["agent"]
                 })
 
+            if session_store:
+                session_store.save(
+                    st.session_state.branch_store_key,
+                    st.session_state.environment,
+                    st.session_state.chat_history
+                )
+
             # Force a rerun to update the chat display
             st.rerun()
     else:
         st.info("Please select at least one character from the sidebar to start the conversation.")
 
 if __name__ == "__main__":
-    main()
+    if profiler.is_enabled(st.query_params):
+        with get_rerun_profiler().profile():
+            main()
+    else:
+        main()
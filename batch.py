@@ -0,0 +1,214 @@
+"""
+Offline batch mode for large, latency-tolerant simulation jobs.
+
+Environment turns are queued, written to a request file in the OpenAI Batch
+JSONL format, submitted through the Batch API and, once the batch completes,
+the responses are written back into agent memories and the chat history.
+"""
+import os
+import json
+import time
+import uuid
+import logging
+from types import SimpleNamespace
+
+logger = logging.getLogger(__name__)
+
+BATCH_ENDPOINT = "/v1/chat/completions"
+TERMINAL_STATUSES = {"completed", "failed", "expired", "cancelled"}
+FALLBACK_RESPONSE = "I apologize, but I am unable to respond at the moment."
+
+
+class BatchRunner:
+    """Collect environment turns and resolve them through a single batch."""
+
+    def __init__(self, temperature=0.7):
+        self.temperature = temperature
+        self.turns = []
+
+    def add_turn(self, environment, message, image_path=None, chat_history=None):
+        """Queue a user message for every agent in the environment.
+
+        The message is delivered to agent memories immediately; responses are
+        filled in when the batch results are applied. An environment can have
+        only one turn per batch, since a second turn would be sent without the
+        first turn's responses and would interleave their memories.
+        """
+        if any(turn["environment"] is environment for turn in self.turns):
+            raise ValueError(f"Environment '{environment.name}' already has a turn in this batch")
+        environment.deliver_message(message, image_path)
+        turn_index = len(self.turns)
+        requests = []
+        for agent_index, agent in enumerate(environment.agents):
+            requests.append({
+                "custom_id": f"turn-{turn_index}-agent-{agent_index}",
+                "method": "POST",
+                "url": BATCH_ENDPOINT,
+                "body": agent.get_request_params(self.temperature)
+            })
+        self.turns.append({
+            "environment": environment,
+            "message": message,
+            "requests": requests,
+            "chat_history": chat_history
+        })
+        return turn_index
+
+    def get_requests(self):
+        """Get all queued batch request lines."""
+        return [request for turn in self.turns for request in turn["requests"]]
+
+    def write_requests(self, filename):
+        """Write the queued requests to a Batch JSONL file."""
+        with open(filename, 'w') as f:
+            for request in self.get_requests():
+                f.write(json.dumps(request) + "\n")
+        return filename
+
+    def submit(self, openai_client, filename):
+        """Upload the request file and create the batch."""
+        self.write_requests(filename)
+        with open(filename, 'rb') as f:
+            input_file = openai_client.files.create(file=f, purpose="batch")
+        batch = openai_client.batches.create(
+            input_file_id=input_file.id,
+            endpoint=BATCH_ENDPOINT,
+            completion_window="24h"
+        )
+        logger.info(f"Submitted batch {batch.id} with {len(self.get_requests())} requests")
+        return batch
+
+    def apply_results(self, results):
+        """Write batch results back into agent memories and chat histories."""
+        all_responses = []
+        for turn_index, turn in enumerate(self.turns):
+            environment = turn["environment"]
+            responses = []
+            for agent_index, agent in enumerate(environment.agents):
+                custom_id = f"turn-{turn_index}-agent-{agent_index}"
+                response = results.get(custom_id)
+                if response is None:
+                    logger.error(f"No batch result for {custom_id}")
+                    response = FALLBACK_RESPONSE
+                else:
+                    agent.speak(response)
+                responses.append({
+                    "agent": agent.name,
+                    "response": response,
+                    "color": agent.config.get("color", "#000000")
+                })
+            if turn["chat_history"] is not None:
+                turn["chat_history"].append({"role": "user", "content": turn["message"] or ""})
+                for response in responses:
+                    turn["chat_history"].append({
+                        "role": "assistant",
+                        "content": response["response"],
+                        "color": response["color"],
+                        "character_type": response["agent"]
+                    })
+            all_responses.append(responses)
+        return all_responses
+
+    def run(self, openai_client, filename, poll_interval=30, timeout=None):
+        """Submit the queued turns, wait for the batch and apply its results."""
+        batch = self.submit(openai_client, filename)
+        batch = wait_for_batch(openai_client, batch.id, poll_interval, timeout)
+        if batch.status != "completed":
+            raise RuntimeError(f"Batch {batch.id} ended with status '{batch.status}'")
+        return self.apply_results(download_results(openai_client, batch))
+
+
+def wait_for_batch(openai_client, batch_id, poll_interval=30, timeout=None):
+    """Poll a batch until it reaches a terminal status."""
+    started = time.monotonic()
+    while True:
+        batch = openai_client.batches.retrieve(batch_id)
+        if batch.status in TERMINAL_STATUSES:
+            return batch
+        if timeout is not None and time.monotonic() - started > timeout:
+            raise TimeoutError(f"Batch {batch_id} still '{batch.status}' after {timeout}s")
+        time.sleep(poll_interval)
+
+
+def parse_results(text):
+    """Parse Batch output JSONL into a mapping of custom_id to response text."""
+    results = {}
+    for line in text.splitlines():
+        if not line.strip():
+            continue
+        record = json.loads(line)
+        response = record.get("response") or {}
+        if record.get("error") or response.get("status_code") != 200:
+            logger.error(f"Batch request {record.get('custom_id')} failed: {record.get('error')}")
+            continue
+        results[record["custom_id"]] = response["body"]["choices"][0]["message"]["content"]
+    return results
+
+
+def download_results(openai_client, batch):
+    """Download and parse the output file of a completed batch."""
+    if not batch.output_file_id:
+        return {}
+    return parse_results(openai_client.files.content(batch.output_file_id).text)
+
+
+class LocalBatchClient:
+    """File-based stand-in for the OpenAI Files and Batches APIs.
+
+    Requests are resolved synchronously on batch creation by `responder`, a
+    callable taking a chat completion request body and returning the reply text.
+    """
+
+    def __init__(self, directory, responder=None):
+        self.directory = directory
+        self.responder = responder or (lambda body: f"[batch reply to {len(body['messages'])} messages]")
+        self._batches = {}
+        os.makedirs(directory, exist_ok=True)
+        self.files = SimpleNamespace(create=self._create_file, content=self._file_content)
+        self.batches = SimpleNamespace(create=self._create_batch, retrieve=self._retrieve_batch)
+
+    def _path(self, file_id):
+        return os.path.join(self.directory, f"{file_id}.jsonl")
+
+    def _write_file(self, data):
+        file_id = f"file-{uuid.uuid4().hex}"
+        with open(self._path(file_id), 'wb') as f:
+            f.write(data)
+        return file_id
+
+    def _create_file(self, file, purpose):
+        return SimpleNamespace(id=self._write_file(file.read()), purpose=purpose)
+
+    def _file_content(self, file_id):
+        with open(self._path(file_id), 'r') as f:
+            return SimpleNamespace(text=f.read())
+
+    def _create_batch(self, input_file_id, endpoint, completion_window):
+        output = []
+        for line in self._file_content(input_file_id).text.splitlines():
+            request = json.loads(line)
+            output.append(json.dumps({
+                "id": f"batch_req_{uuid.uuid4().hex}",
+                "custom_id": request["custom_id"],
+                "response": {
+                    "status_code": 200,
+                    "body": {"choices": [{"index": 0, "message": {
+                        "role": "assistant",
+                        "content": self.responder(request["body"])
+                    }}]}
+                },
+                "error": None
+            }))
+        batch = SimpleNamespace(
+            id=f"batch_{uuid.uuid4().hex}",
+            status="completed",
+            endpoint=endpoint,
+            input_file_id=input_file_id,
+            output_file_id=self._write_file("\n".join(output).encode('utf-8')),
+            error_file_id=None
+        )
+        self._batches[batch.id] = batch
+        return batch
+
+    def _retrieve_batch(self, batch_id):
+        return self._batches[batch_id]
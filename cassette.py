@@ -0,0 +1,144 @@
+"""
+Record/replay of chat completions for offline, deterministic reruns.
+
+In record mode every request made through the wrapped client is forwarded and
+the request/response pair is appended to a JSONL cassette, which is emptied
+when the recording client is created. In replay mode
+responses are served from the cassette by canonical request key without any
+network access. Identical requests are replayed in the order they were
+recorded.
+"""
+import os
+import json
+import hashlib
+import logging
+import threading
+from collections import defaultdict, deque
+from types import SimpleNamespace
+
+logger = logging.getLogger(__name__)
+
+# Per-call transport options that do not change the response.
+IGNORED_PARAMS = {"timeout"}
+
+
+class CassetteMismatchError(Exception):
+    """Raised in replay mode when a request is not in the cassette."""
+
+
+def request_key(params):
+    """Get the canonical key of a chat completion request."""
+    canonical = {k: v for k, v in params.items() if k not in IGNORED_PARAMS}
+    encoded = json.dumps(canonical, sort_keys=True, separators=(",", ":"), ensure_ascii=False)
+    return hashlib.sha256(encoded.encode("utf-8")).hexdigest()
+
+
+def describe_mismatch(params, recorded):
+    """Explain how a request differs from the closest recorded request."""
+    if not recorded:
+        return "the cassette is empty"
+    messages = params.get("messages", [])
+
+    def shared_prefix(request):
+        other = request.get("messages", [])
+        count = 0
+        for ours, theirs in zip(messages, other):
+            if ours != theirs:
+                break
+            count += 1
+        return count
+
+    closest = max(recorded, key=lambda r: (shared_prefix(r), -abs(len(r.get("messages", [])) - len(messages))))
+    other_messages = closest.get("messages", [])
+    index = shared_prefix(closest)
+    for key in sorted(set(params) | set(closest)):
+        if key not in IGNORED_PARAMS and key != "messages" and params.get(key) != closest.get(key):
+            return f"'{key}' is {params.get(key)!r}, closest recording has {closest.get(key)!r}"
+    if index < len(messages) and index < len(other_messages):
+        return (f"message {index} differs: {messages[index]['content'][:80]!r} "
+                f"vs recorded {other_messages[index]['content'][:80]!r}")
+    return f"request has {len(messages)} messages, closest recording has {len(other_messages)}"
+
+
+class CassetteClient:
+    """Wraps an OpenAI client (record) or replaces it (replay) for chat completions."""
+
+    def __init__(self, path, mode="replay", openai_client=None):
+        if mode not in ("record", "replay"):
+            raise ValueError(f"Unknown cassette mode: {mode}")
+        if mode == "record" and openai_client is None:
+            raise ValueError("Record mode needs an OpenAI client")
+        self.path = path
+        self.mode = mode
+        self.client = openai_client
+        self.mismatches = []
+        self._lock = threading.Lock()
+        self._entries = defaultdict(deque)
+        self._requests = []
+        if mode == "replay":
+            if not os.path.exists(path):
+                raise FileNotFoundError(f"Cassette {path} not found; record it first with CASSETTE_MODE=record")
+            self._load()
+        else:
+            # Start a fresh recording so old responses are not replayed first.
+            open(path, 'w').close()
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self.create))
+
+    def _load(self):
+        with open(self.path, 'r') as f:
+            for line in f:
+                if line.strip():
+                    entry = json.loads(line)
+                    self._entries[entry["key"]].append(entry["response"])
+                    self._requests.append(entry["request"])
+
+    def create(self, **params):
+        """Create a chat completion, recording or replaying it."""
+        if self.mode == "record":
+            return self._record(params)
+        return self._replay(params)
+
+    def _record(self, params):
+        response = self.client.chat.completions.create(**params)
+        usage = getattr(response, "usage", None)
+        entry = {
+            "key": request_key(params),
+            "request": {k: v for k, v in params.items() if k not in IGNORED_PARAMS},
+            "response": {
+                "content": response.choices[0].message.content,
+                "prompt_tokens": getattr(usage, "prompt_tokens", None),
+                "completion_tokens": getattr(usage, "completion_tokens", None),
+                "cached_tokens": getattr(getattr(usage, "prompt_tokens_details", None), "cached_tokens", None)
+            }
+        }
+        with self._lock:
+            with open(self.path, 'a') as f:
+                f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+        return response
+
+    def _replay(self, params):
+        key = request_key(params)
+        with self._lock:
+            recorded = self._entries.get(key)
+            if not recorded:
+                reason = describe_mismatch(params, self._requests)
+                if key in self._entries:
+                    reason = "all recorded responses for this request were already replayed"
+                self.mismatches.append({"key": key, "reason": reason})
+                logger.error(f"Cassette mismatch for request {key[:12]}: {reason}")
+                raise CassetteMismatchError(f"No recorded response for request {key[:12]}: {reason}")
+            response = recorded.popleft()
+        return SimpleNamespace(
+            choices=[SimpleNamespace(message=SimpleNamespace(role="assistant", content=response["content"]))],
+            usage=SimpleNamespace(
+                prompt_tokens=response["prompt_tokens"],
+                completion_tokens=response["completion_tokens"],
+                prompt_tokens_details=SimpleNamespace(cached_tokens=response.get("cached_tokens"))
+            )
+        )
+
+    def check(self):
+        """Raise if any replayed request was missing from the cassette."""
+        if self.mismatches:
+            details = "\n".join(f"- {m['key'][:12]}: {m['reason']}" for m in self.mismatches)
+            raise CassetteMismatchError(f"{len(self.mismatches)} request(s) not found in {self.path}:\n{details}")
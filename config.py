@@ -7,6 +7,20 @@ load_dotenv()
 # OpenAI API configuration
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
 
+# Optional directory for persisting sessions across workers and restarts
+SESSION_STORE_DIR = os.getenv("SESSION_STORE_DIR")
+
+# Optional per-turn deadline in seconds and hedged-request percentile for slow persona calls
+TURN_DEADLINE = float(os.getenv("TURN_DEADLINE")) if os.getenv("TURN_DEADLINE") else None
+HEDGE_PERCENTILE = float(os.getenv("HEDGE_PERCENTILE")) if os.getenv("HEDGE_PERCENTILE") else None
+
+# Optional record/replay of LLM calls: CASSETTE_MODE is "record" or "replay"
+CASSETTE_PATH = os.getenv("CASSETTE_PATH")
+CASSETTE_MODE = os.getenv("CASSETTE_MODE", "replay")
+
+# Number of concurrent LLM calls shared fairly by all sessions of the app
+LLM_GATEWAY_WORKERS = int(os.getenv("LLM_GATEWAY_WORKERS", "8"))
+
 # App paths
 STATIC_DIR = "static"
 AVATARS_DIR = os.path.join(STATIC_DIR, "avatars")
@@ -0,0 +1,180 @@
+"""
+Process-wide LLM gateway with fair queuing across sessions.
+
+All sessions submit chat completions to one gateway, which runs them on a
+bounded pool of worker threads sharing a single OpenAI client (and so a single
+HTTP connection pool). Interactive requests are served before batch requests,
+and within each priority sessions take turns in weighted round-robin order, so
+one session with many queued calls cannot starve the others.
+
+With a hedging policy, interactive calls are hedged below the queue: only
+execution time is measured, duplicates go straight to the provider instead of
+back into the session's queue, and no duplicates are sent while interactive
+requests are waiting.
+"""
+import time
+import logging
+import threading
+from collections import deque
+from concurrent.futures import Future, TimeoutError
+from types import SimpleNamespace
+from utils import percentile
+
+logger = logging.getLogger(__name__)
+
+INTERACTIVE = 0
+BATCH = 1
+
+
+class GatewayClient:
+    """OpenAI-client-shaped handle that routes chat completions through the gateway."""
+
+    def __init__(self, gateway, session_id, priority=INTERACTIVE, weight=1):
+        self.gateway = gateway
+        self.session_id = session_id
+        self.priority = priority
+        self.weight = weight
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self.create))
+
+    def create(self, **params):
+        future = self.gateway.submit(self.session_id, params, self.priority, self.weight)
+        try:
+            return future.result(timeout=params.get("timeout"))
+        except TimeoutError:
+            future.cancel()
+            raise
+
+
+class LLMGateway:
+    """Bounded worker pool with per-session fair queuing and two priorities.
+
+    Each session gets `weight` consecutive dispatches per round. Interactive
+    requests always go first, except that every `batch_every`-th dispatch is
+    given to a waiting batch request so batch jobs keep making progress.
+    """
+
+    def __init__(self, openai_client, workers=8, batch_every=10, hedging=None):
+        self.client = openai_client
+        self.batch_every = batch_every
+        self.hedging = hedging
+        self.in_flight = 0
+        self.completed = 0
+        self._cond = threading.Condition()
+        self._queues = {INTERACTIVE: {}, BATCH: {}}
+        self._rings = {INTERACTIVE: deque(), BATCH: deque()}
+        self._weights = {}
+        self._credits = {}
+        self._dispatched = 0
+        self._waits = deque(maxlen=1000)
+        self._closed = False
+        self._workers = [
+            threading.Thread(target=self._work, name=f"llm-gateway-{i}", daemon=True)
+            for i in range(workers)
+        ]
+        for worker in self._workers:
+            worker.start()
+
+    def client_for(self, session_id, priority=INTERACTIVE, weight=1):
+        """Get a client-like handle for a session."""
+        return GatewayClient(self, session_id, priority, weight)
+
+    def submit(self, session_id, params, priority=INTERACTIVE, weight=1):
+        """Queue a chat completion for a session, returning a Future."""
+        future = Future()
+        with self._cond:
+            if self._closed:
+                raise RuntimeError("LLM gateway is closed")
+            queues = self._queues[priority]
+            key = (priority, session_id)
+            if session_id not in queues:
+                queues[session_id] = deque()
+                self._rings[priority].append(session_id)
+                self._credits[key] = weight
+            self._weights[key] = weight
+            queues[session_id].append((future, params, priority, time.monotonic()))
+            self._cond.notify()
+        return future
+
+    def _pick_priority(self):
+        waiting = [p for p in (INTERACTIVE, BATCH) if self._rings[p]]
+        if not waiting:
+            return None
+        if len(waiting) == 2 and self.batch_every and self._dispatched % self.batch_every == self.batch_every - 1:
+            return BATCH
+        return waiting[0]
+
+    def _next_job(self):
+        """Pop the next job in fair order; call with the condition held."""
+        priority = self._pick_priority()
+        if priority is None:
+            return None
+        ring = self._rings[priority]
+        queues = self._queues[priority]
+        session_id = ring[0]
+        key = (priority, session_id)
+        job = queues[session_id].popleft()
+        self._credits[key] -= 1
+        if not queues[session_id]:
+            del queues[session_id]
+            del self._credits[key]
+            del self._weights[key]
+            ring.popleft()
+        elif self._credits[key] <= 0:
+            self._credits[key] = self._weights[key]
+            ring.rotate(-1)
+        self._dispatched += 1
+        return job
+
+    def _work(self):
+        while True:
+            with self._cond:
+                job = self._next_job()
+                while job is None:
+                    if self._closed:
+                        return
+                    self._cond.wait()
+                    job = self._next_job()
+                future, params, priority, enqueued = job
+                if not future.set_running_or_notify_cancel():
+                    continue
+                self._waits.append(time.monotonic() - enqueued)
+                self.in_flight += 1
+            try:
+                call = lambda: self.client.chat.completions.create(**params)
+                if self.hedging and priority == INTERACTIVE:
+                    future.set_result(self.hedging.submit(call, self.has_no_backlog).result())
+                else:
+                    future.set_result(call())
+            except Exception as e:
+                future.set_exception(e)
+            finally:
+                with self._cond:
+                    self.in_flight -= 1
+                    self.completed += 1
+
+    def has_no_backlog(self):
+        """Check that no interactive request is waiting for a worker."""
+        return not self._queues[INTERACTIVE]
+
+    def metrics(self):
+        """Get queue depths, in-flight calls and queue wait percentiles."""
+        with self._cond:
+            depth = {
+                name: sum(len(q) for q in self._queues[priority].values())
+                for name, priority in (("interactive", INTERACTIVE), ("batch", BATCH))
+            }
+            waits = list(self._waits)
+            return {
+                "queue_depth": depth,
+                "queued_sessions": len(self._queues[INTERACTIVE]) + len(self._queues[BATCH]),
+                "in_flight": self.in_flight,
+                "completed": self.completed,
+                "wait_p50": percentile(waits, 50),
+                "wait_p95": percentile(waits, 95)
+            }
+
+    def close(self):
+        """Stop the workers once queued work is done."""
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
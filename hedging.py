@@ -0,0 +1,120 @@
+"""
+Hedged requests for tail latency.
+
+When a call runs longer than a chosen percentile of recently observed
+latencies, a duplicate is started and whichever finishes first wins. Pending
+duplicates are cancelled; ones already running cannot be interrupted in a
+thread, so their results are discarded when they arrive.
+"""
+import time
+import logging
+import threading
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from utils import percentile
+
+logger = logging.getLogger(__name__)
+
+
+class LatencyTracker:
+    """Rolling window of observed call latencies."""
+
+    def __init__(self, window=200):
+        self._samples = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def record(self, latency):
+        with self._lock:
+            self._samples.append(latency)
+
+    def __len__(self):
+        return len(self._samples)
+
+    def percentile(self, pct):
+        with self._lock:
+            return percentile(list(self._samples), pct)
+
+
+class HedgingPolicy:
+    """Run calls on a shared pool, hedging those slower than the `hedge_percentile` latency.
+
+    No hedges are sent until `min_samples` latencies have been observed, and at
+    most `max_hedges` duplicates are sent per call. Share one policy across
+    turns so the latency estimate reflects recent traffic.
+    """
+
+    def __init__(self, hedge_percentile=95, min_samples=20, max_hedges=1, window=200, max_workers=32):
+        self.hedge_percentile = hedge_percentile
+        self.min_samples = min_samples
+        self.max_hedges = max_hedges
+        self.tracker = LatencyTracker(window)
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="hedged")
+        self.hedges_sent = 0
+        self.hedges_won = 0
+
+    def hedge_delay(self):
+        """Get the delay after which a duplicate is sent, or None while warming up."""
+        if len(self.tracker) < self.min_samples:
+            return None
+        return self.tracker.percentile(self.hedge_percentile)
+
+    def submit(self, fn, can_hedge=None):
+        """Submit a call, returning a Future resolved by the first attempt to finish.
+
+        When given, `can_hedge()` is checked before each duplicate is sent, so
+        callers can suppress hedges while they are overloaded.
+        """
+        result = Future()
+        attempts = []
+        lock = threading.RLock()
+
+        def settle(attempt, started, hedged):
+            if attempt.cancelled():
+                return
+            self.tracker.record(time.monotonic() - started)
+            with lock:
+                if result.done():
+                    return
+                if attempt.exception() is not None:
+                    # Let another attempt win if one is still running.
+                    if any(not a.done() for a in attempts):
+                        return
+                    result.set_exception(attempt.exception())
+                else:
+                    result.set_result(attempt.result())
+                    if hedged:
+                        self.hedges_won += 1
+                for other in attempts:
+                    if other is not attempt:
+                        other.cancel()
+
+        def launch(hedged=False):
+            if hedged and can_hedge is not None and not can_hedge():
+                return
+            with lock:
+                if result.done():
+                    return
+                started = time.monotonic()
+                attempt = self.executor.submit(fn)
+                attempts.append(attempt)
+            if hedged:
+                self.hedges_sent += 1
+                logger.info("Sent hedged request")
+            attempt.add_done_callback(lambda a: settle(a, started, hedged))
+
+        def on_result(_):
+            if result.cancelled():
+                with lock:
+                    for attempt in attempts:
+                        attempt.cancel()
+
+        result.add_done_callback(on_result)
+        launch()
+        delay = self.hedge_delay()
+        if delay is not None:
+            for i in range(self.max_hedges):
+                timer = threading.Timer(delay * (i + 1), launch, kwargs={"hedged": True})
+                timer.daemon = True
+                timer.start()
+                result.add_done_callback(lambda _, timer=timer: timer.cancel())
+        return result
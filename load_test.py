@@ -0,0 +1,238 @@
+"""
+Offline load-test harness for capacity planning.
+
+Simulates K concurrent sessions, each a ChatEnvironment with M personas sending
+a scripted message sequence through `process_message`, against a fake LLM
+client with configurable latency, error and rate-limit behavior. The fake
+provider has a finite capacity (concurrent requests and tokens per minute), so
+throughput levels off once it is saturated. Run with increasing K to find the
+saturation point:
+
+    python load_test.py --sessions 1 2 4 8 16 32 --personas 3 --turns 5
+"""
+import time
+import random
+from collections import deque
+import logging
+import argparse
+import threading
+import tracemalloc
+from types import SimpleNamespace
+from concurrent.futures import ThreadPoolExecutor
+import config
+from utils import ChatEnvironment, create_character, percentile
+
+DEFAULT_SCRIPT = [
+    "Hi everyone, thanks for joining. What is your first impression of our new product?",
+    "The launch price is $49 per month. Is that reasonable?",
+    "What would make you recommend it to a friend?",
+    "Which risks should we address before launch?",
+    "Summarize your position in one sentence."
+]
+
+
+class SimulatedAPIError(Exception):
+    """Error raised by the fake LLM client."""
+
+    def __init__(self, message, status_code=500):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+class FakeLLMClient:
+    """Stand-in for the OpenAI client with configurable latency and failures.
+
+    `latency` is one of "constant", "uniform", "exponential" or "lognormal";
+    `median` is in seconds and `spread` is the lognormal sigma (or the uniform
+    half-width as a fraction of the median). Calls fail with a 500 at
+    `error_rate` and with a 429 at `rate_limit_rate`.
+
+    Provider capacity: at most `max_concurrency` calls are served at once and
+    the rest wait their turn, and calls that would exceed `tokens_per_minute`
+    over the last minute fail with a 429. Either limit is off when None.
+    """
+
+    def __init__(self, latency="lognormal", median=0.8, spread=0.5, error_rate=0.0,
+                 rate_limit_rate=0.0, seed=None, reply="Thanks, that is an interesting point.",
+                 max_concurrency=None, tokens_per_minute=None):
+        self.latency = latency
+        self.median = median
+        self.spread = spread
+        self.error_rate = error_rate
+        self.rate_limit_rate = rate_limit_rate
+        self.reply = reply
+        self.calls = 0
+        self.errors = 0
+        self.rate_limited = 0
+        self.tokens_per_minute = tokens_per_minute
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(max_concurrency) if max_concurrency else None
+        self._token_log = deque()
+        self._tokens_in_window = 0
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self.create))
+
+    def sample_latency(self):
+        """Draw a latency in seconds from the configured distribution."""
+        if self.latency == "constant":
+            return self.median
+        if self.latency == "uniform":
+            return self._random.uniform(self.median * (1 - self.spread), self.median * (1 + self.spread))
+        if self.latency == "exponential":
+            return self._random.expovariate(1 / self.median)
+        if self.latency == "lognormal":
+            return self.median * self._random.lognormvariate(0, self.spread)
+        raise ValueError(f"Unknown latency distribution: {self.latency}")
+
+    def _spend_tokens(self, tokens):
+        """Charge tokens to the per-minute budget; call with the lock held."""
+        if not self.tokens_per_minute:
+            return True
+        now = time.monotonic()
+        while self._token_log and now - self._token_log[0][0] >= 60:
+            self._tokens_in_window -= self._token_log.popleft()[1]
+        if self._tokens_in_window + tokens > self.tokens_per_minute:
+            return False
+        self._token_log.append((now, tokens))
+        self._tokens_in_window += tokens
+        return True
+
+    def create(self, model, messages, **kwargs):
+        prompt_tokens = sum(len(m["content"]) for m in messages) // 4
+        with self._lock:
+            self.calls += 1
+            delay = self.sample_latency()
+            roll = self._random.random()
+            within_budget = self._spend_tokens(prompt_tokens + len(self.reply) // 4)
+            if not within_budget:
+                self.rate_limited += 1
+        if not within_budget:
+            raise SimulatedAPIError("Tokens per minute limit reached", status_code=429)
+        if self._slots:
+            self._slots.acquire()
+        try:
+            time.sleep(delay)
+        finally:
+            if self._slots:
+                self._slots.release()
+        if roll < self.rate_limit_rate:
+            with self._lock:
+                self.rate_limited += 1
+            raise SimulatedAPIError("Rate limit reached", status_code=429)
+        if roll < self.rate_limit_rate + self.error_rate:
+            with self._lock:
+                self.errors += 1
+            raise SimulatedAPIError("Internal server error")
+        return SimpleNamespace(
+            choices=[SimpleNamespace(message=SimpleNamespace(role="assistant", content=self.reply))],
+            usage=SimpleNamespace(prompt_tokens=prompt_tokens, completion_tokens=len(self.reply) // 4)
+        )
+
+
+def run_session(client, characters, script, description):
+    """Run one scripted session, returning its per-turn latencies."""
+    environment = ChatEnvironment(
+        name="Load Test",
+        agents=[create_character(dict(config.CHARACTERS[char])) for char in characters],
+        description=description
+    )
+    latencies = []
+    for message in script:
+        started = time.perf_counter()
+        environment.process_message(message, client)
+        latencies.append(time.perf_counter() - started)
+    return latencies, environment
+
+
+def measure_session_memory(characters, script, description, reply, sessions=4):
+    """Measure the retained memory per session in an untimed pass against an instant client."""
+    client = FakeLLMClient(latency="constant", median=0.0, reply=reply)
+    tracemalloc.start()
+    try:
+        memory_before = tracemalloc.get_traced_memory()[0]
+        # Keep the environments referenced so this is retained session state.
+        results = [run_session(client, characters, script, description) for _ in range(sessions)]
+        memory_growth = tracemalloc.get_traced_memory()[0] - memory_before
+    finally:
+        tracemalloc.stop()
+    del results
+    return memory_growth / sessions
+
+
+def run_load(sessions, personas, client, script=None, description="A product launch focus group."):
+    """Run `sessions` concurrent sessions and report throughput and latency."""
+    script = script or DEFAULT_SCRIPT
+    characters = list(config.CHARACTERS)[:personas]
+    calls_before = (client.calls, client.errors, client.rate_limited)
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=sessions) as pool:
+        results = list(pool.map(lambda _: run_session(client, characters, script, description), range(sessions)))
+    elapsed = time.perf_counter() - started
+    latencies = [latency for session_latencies, _ in results for latency in session_latencies]
+    return {
+        "sessions": sessions,
+        "personas": personas,
+        "turns": len(latencies),
+        "elapsed": elapsed,
+        "throughput": len(latencies) / elapsed if elapsed else 0.0,
+        "p50": percentile(latencies, 50),
+        "p95": percentile(latencies, 95),
+        "p99": percentile(latencies, 99),
+        "memory_per_session": measure_session_memory(characters, script, description, client.reply,
+                                                     min(sessions, 4)),
+        "llm_calls": client.calls - calls_before[0],
+        "errors": client.errors - calls_before[1],
+        "rate_limited": client.rate_limited - calls_before[2]
+    }
+
+
+def find_saturation(reports, min_gain=0.1):
+    """Get the first session count where throughput stops growing by at least `min_gain`."""
+    for previous, current in zip(reports, reports[1:]):
+        if current["throughput"] < previous["throughput"] * (1 + min_gain):
+            return previous["sessions"]
+    return None
+
+
+def format_report(report):
+    """Format a load report as one table row."""
+    return (f"{report['sessions']:>8} {report['throughput']:>10.2f} {report['p50']:>8.2f} "
+            f"{report['p95']:>8.2f} {report['p99']:>8.2f} {report['memory_per_session'] / 1024:>10.1f} "
+            f"{report['errors']:>6} {report['rate_limited']:>6}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline load test for the persona simulator")
+    parser.add_argument("--sessions", type=int, nargs="+", default=[1, 2, 4, 8, 16, 32])
+    parser.add_argument("--personas", type=int, default=3)
+    parser.add_argument("--turns", type=int, default=len(DEFAULT_SCRIPT))
+    parser.add_argument("--latency", default="lognormal", choices=["constant", "uniform", "exponential", "lognormal"])
+    parser.add_argument("--median", type=float, default=0.8, help="Median LLM latency in seconds")
+    parser.add_argument("--spread", type=float, default=0.5)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0)
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--max-concurrency", type=int, default=32, help="Provider concurrent request limit (0 = none)")
+    parser.add_argument("--tpm", type=int, default=0, help="Provider tokens-per-minute budget (0 = none)")
+    args = parser.parse_args()
+
+    # Injected failures are counted in the report; don't log each one.
+    logging.getLogger("agent").setLevel(logging.CRITICAL)
+    script = (DEFAULT_SCRIPT * (args.turns // len(DEFAULT_SCRIPT) + 1))[:args.turns]
+    client = FakeLLMClient(args.latency, args.median, args.spread, args.error_rate, args.rate_limit_rate, args.seed,
+                           max_concurrency=args.max_concurrency or None, tokens_per_minute=args.tpm or None)
+    print(f"{'sessions':>8} {'turns/s':>10} {'p50 s':>8} {'p95 s':>8} {'p99 s':>8} {'KiB/sess':>10} {'errors':>6} {'429s':>6}")
+    reports = []
+    for sessions in args.sessions:
+        report = run_load(sessions, args.personas, client, script)
+        reports.append(report)
+        print(format_report(report))
+    saturation = find_saturation(reports)
+    if saturation:
+        print(f"\nThroughput saturates at about {saturation} concurrent sessions.")
+    else:
+        print("\nNo saturation observed in the tested range.")
+
+
+if __name__ == "__main__":
+    main()
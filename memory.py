@@ -0,0 +1,140 @@
+"""
+Semantic memory index for long-running agents.
+
+Memory entries are embedded incrementally as they are appended and stored in
+a contiguous NumPy matrix so retrieval is a single matrix-vector product
+followed by a partial sort.
+"""
+import re
+import zlib
+import numpy as np
+
+TOKEN_PATTERN = re.compile(r"[a-z0-9']+")
+
+
+class HashingEmbedder:
+    """Offline embedder that hashes word unigrams and bigrams into a fixed-size vector."""
+
+    def __init__(self, dim=512):
+        self.dim = dim
+
+    def _features(self, text):
+        tokens = TOKEN_PATTERN.findall(text.lower())
+        return tokens + [f"{a} {b}" for a, b in zip(tokens, tokens[1:])]
+
+    def __call__(self, texts):
+        vectors = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for row, text in enumerate(texts):
+            features = self._features(text)
+            if not features:
+                continue
+            hashes = np.array([zlib.crc32(f.encode('utf-8')) for f in features], dtype=np.uint32)
+            signs = np.where(hashes & 1, 1.0, -1.0).astype(np.float32)
+            np.add.at(vectors[row], (hashes >> 1) % self.dim, signs)
+        return vectors
+
+
+class OpenAIEmbedder:
+    """Embedder backed by the OpenAI embeddings endpoint."""
+
+    def __init__(self, openai_client, model="text-embedding-3-small"):
+        self.client = openai_client
+        self.model = model
+
+    def __call__(self, texts):
+        response = self.client.embeddings.create(model=self.model, input=list(texts))
+        return np.array([item.embedding for item in response.data], dtype=np.float32)
+
+
+def memory_text(entry):
+    """Get the text of a memory entry used for embedding."""
+    return entry.get('content') or ""
+
+
+class SemanticMemoryIndex:
+    """Top-k cosine retrieval over an agent's memory entries.
+
+    Row `i` of the index holds the normalized embedding of memory entry `i`.
+    A forked index reads its first `base` rows from its parent and stores only
+    the rows added after the fork in its own matrix.
+    """
+
+    # Initial rows of a fork's own matrix; it grows with the branch's divergence.
+    FORK_CAPACITY = 8
+
+    def __init__(self, embedder=None, recent_limit=3, relevant_limit=3, initial_capacity=64):
+        self.embedder = embedder or HashingEmbedder()
+        self.recent_limit = recent_limit
+        self.relevant_limit = relevant_limit
+        self.parent = None
+        self.base = 0
+        self._matrix = None
+        self._capacity = initial_capacity
+        self.size = 0
+
+    def fork(self):
+        """Create an index sharing this one's embeddings without copying them.
+
+        The parent may keep growing; rows it adds after the fork are not
+        visible to the fork.
+        """
+        index = SemanticMemoryIndex(self.embedder, self.recent_limit, self.relevant_limit, self.FORK_CAPACITY)
+        index.parent = self
+        index.base = index.size = self.size
+        return index
+
+    def _normalize(self, vectors):
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        return vectors / norms
+
+    def _reserve(self, rows, dim):
+        own = self.size - self.base
+        if self._matrix is None:
+            self._capacity = max(self._capacity, rows)
+            self._matrix = np.zeros((self._capacity, dim), dtype=np.float32)
+        elif own + rows > self._capacity:
+            while own + rows > self._capacity:
+                self._capacity *= 2
+            grown = np.zeros((self._capacity, dim), dtype=np.float32)
+            grown[:own] = self._matrix[:own]
+            self._matrix = grown
+
+    def add(self, entries):
+        """Embed and index memory entries appended after the current size."""
+        if not entries:
+            return
+        vectors = self._normalize(np.asarray(self.embedder([memory_text(e) for e in entries]), dtype=np.float32))
+        self._reserve(len(vectors), vectors.shape[1])
+        own = self.size - self.base
+        self._matrix[own:own + len(vectors)] = vectors
+        self.size += len(vectors)
+
+    def _scores(self, query_vector, rows):
+        """Get similarity scores for the first `rows` entries, including shared ones."""
+        parts = []
+        if self.parent is not None and self.base:
+            parts.append(self.parent._scores(query_vector, min(rows, self.base)))
+        own = rows - self.base
+        if own > 0:
+            parts.append(self._matrix[:own] @ query_vector)
+        return np.concatenate(parts) if parts else np.zeros(0, dtype=np.float32)
+
+    def search(self, query, limit=None, exclude_from=None):
+        """Get memory positions most similar to the query, best first.
+
+        Positions at or after `exclude_from` are skipped, which lets callers
+        leave out entries they already send as recent memory.
+        """
+        limit = self.relevant_limit if limit is None else limit
+        candidates = self.size if exclude_from is None else min(exclude_from, self.size)
+        if limit <= 0 or candidates <= 0 or not query:
+            return []
+        query_vector = self._normalize(np.asarray(self.embedder([query]), dtype=np.float32))[0]
+        scores = self._scores(query_vector, candidates)
+        if limit < candidates:
+            top = np.argpartition(-scores, limit - 1)[:limit]
+        else:
+            top = np.arange(candidates)
+        top = top[scores[top] > 0]
+        return top[np.argsort(-scores[top])].tolist()
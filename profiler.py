@@ -0,0 +1,131 @@
+"""
+Opt-in per-rerun profiling for the Streamlit app.
+
+Each profiled rerun runs under cProfile with tracemalloc snapshots taken before
+and after. The slowest reruns are kept in a rolling buffer together with their
+top functions, allocation growth and a pstats dump that can be downloaded and
+opened with `python -m pstats` or snakeviz.
+"""
+import io
+import os
+import time
+import heapq
+import marshal
+import pstats
+import cProfile
+import logging
+import itertools
+import threading
+import tracemalloc
+from contextlib import contextmanager
+from datetime import datetime
+
+logger = logging.getLogger(__name__)
+
+TRACEMALLOC_FRAMES = 5
+
+
+def is_enabled(query_params=None):
+    """Check the PROFILE_RERUNS env var or a `profile` query parameter."""
+    if os.getenv("PROFILE_RERUNS", "").lower() in ("1", "true", "yes"):
+        return True
+    return bool(query_params) and query_params.get("profile") in ("1", "true", "yes")
+
+
+class RerunProfiler:
+    """Profile script reruns and keep the `keep` slowest ones."""
+
+    def __init__(self, keep=10, top=15):
+        self.keep = keep
+        self.top = top
+        self.reruns_profiled = 0
+        self._slowest = []
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+        self._active = 0
+        self._started_tracing = False
+
+    def _start_tracing(self):
+        """Start tracemalloc for the first active profiled rerun."""
+        with self._lock:
+            if self._active == 0 and not tracemalloc.is_tracing():
+                tracemalloc.start(TRACEMALLOC_FRAMES)
+                self._started_tracing = True
+            self._active += 1
+
+    def _stop_tracing(self):
+        """Stop tracemalloc once no profiled rerun is active, unless someone else started it."""
+        with self._lock:
+            self._active -= 1
+            if self._active == 0 and self._started_tracing:
+                tracemalloc.stop()
+                self._started_tracing = False
+
+    @contextmanager
+    def profile(self, label=""):
+        """Profile the enclosed block, including reruns ended by control-flow exceptions."""
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+        except ValueError:
+            # Another rerun is being profiled on a different thread (Python 3.12+).
+            yield
+            return
+        self._start_tracing()
+        try:
+            before = tracemalloc.take_snapshot()
+            started = time.perf_counter()
+            try:
+                yield
+            finally:
+                profile.disable()
+                duration = time.perf_counter() - started
+                after = tracemalloc.take_snapshot()
+                self._record(label, duration, profile, before, after)
+        finally:
+            self._stop_tracing()
+
+    def _record(self, label, duration, profile, before, after):
+        stream = io.StringIO()
+        stats = pstats.Stats(profile, stream=stream)
+        stats.sort_stats("cumulative")
+        top_functions = []
+        for func in stats.fcn_list[:self.top]:
+            calls, _, total_time, cumulative_time, _ = stats.stats[func]
+            filename, line, name = func
+            top_functions.append({
+                "function": f"{os.path.basename(filename)}:{line}({name})",
+                "calls": calls,
+                "total_time": total_time,
+                "cumulative_time": cumulative_time
+            })
+        differences = after.compare_to(before, "lineno")
+        allocations = [
+            {"location": str(diff.traceback[0]), "size_diff": diff.size_diff, "count_diff": diff.count_diff}
+            for diff in differences[:self.top]
+        ]
+        profile.create_stats()
+        record = {
+            "id": next(self._ids),
+            "label": label,
+            "started": datetime.now().isoformat(timespec="seconds"),
+            "duration": duration,
+            "top_functions": top_functions,
+            "allocations": allocations,
+            "memory_growth": sum(diff.size_diff for diff in differences),
+            "dump": marshal.dumps(profile.stats)
+        }
+        with self._lock:
+            self.reruns_profiled += 1
+            entry = (duration, record["id"], record)
+            if len(self._slowest) < self.keep:
+                heapq.heappush(self._slowest, entry)
+            else:
+                heapq.heappushpop(self._slowest, entry)
+        logger.debug(f"Profiled rerun {record['id']} in {duration:.3f}s")
+
+    def slowest(self):
+        """Get the recorded reruns, slowest first."""
+        with self._lock:
+            return [record for _, _, record in sorted(self._slowest, key=lambda e: (e[0], e[1]), reverse=True)]
+
@@ -0,0 +1,374 @@
+"""
+Async HTTP/WebSocket service around ChatEnvironment.
+
+Endpoints:
+    POST /sessions                      create an environment
+    POST /sessions/{session_id}/messages    send a message, get all responses
+    POST /sessions/{session_id}/stream      send a message, stream tokens (SSE)
+    GET  /sessions/{session_id}/ws          WebSocket: send messages, receive tokens
+    DELETE /sessions/{session_id}           delete a session
+    GET  /metrics                       active sessions and in-flight calls
+
+Run with: python server.py --port 8080
+"""
+import os
+import json
+import time
+import uuid
+import asyncio
+import logging
+import argparse
+from aiohttp import web, WSMsgType
+from openai import AsyncOpenAI
+import config
+from utils import ChatEnvironment, create_character
+
+logger = logging.getLogger(__name__)
+
+
+class ServiceBusy(Exception):
+    """Raised when the service cannot accept more work."""
+
+
+class Session:
+    """A chat environment with its history; one turn runs at a time."""
+
+    def __init__(self, environment, temperature=0.7):
+        self.environment = environment
+        self.temperature = temperature
+        self.chat_history = []
+        self.lock = asyncio.Lock()
+        self.last_used = time.monotonic()
+
+    def is_idle(self, idle_timeout):
+        """Check whether the session has no running turn and was not used recently."""
+        return not self.lock.locked() and time.monotonic() - self.last_used > idle_timeout
+
+
+class SimulatorService:
+    """Session registry with bounded concurrency for LLM calls.
+
+    Backpressure is applied at three levels: `max_concurrency` caps in-flight
+    completions across all sessions, `max_pending_turns` rejects new turns with
+    503 once too many are waiting, and stream writes await the client's
+    transport so slow readers slow their own session down.
+
+    Sessions unused for `idle_timeout` seconds are evicted from memory; with a
+    session store they are restored on their next request.
+    """
+
+    def __init__(self, openai_client, max_concurrency=32, max_pending_turns=256, max_sessions=10000,
+                 session_store=None, idle_timeout=1800):
+        self.client = openai_client
+        self.sessions = {}
+        self.max_sessions = max_sessions
+        self.idle_timeout = idle_timeout
+        self.max_pending_turns = max_pending_turns
+        self.pending_turns = 0
+        self.in_flight = 0
+        self.session_store = session_store
+        self._limiter = asyncio.Semaphore(max_concurrency)
+
+    async def create_session(self, characters, description="", temperature=0.7):
+        """Create an environment from persona types in `config.CHARACTERS`.
+
+        With a session store the new session is saved right away, so it
+        survives eviction and is reachable from other workers before its first turn.
+        """
+        if len(self.sessions) >= self.max_sessions:
+            self.evict_idle()
+        if len(self.sessions) >= self.max_sessions:
+            raise ServiceBusy("Too many sessions")
+        unknown = [char for char in characters if char not in config.CHARACTERS]
+        if unknown or not characters:
+            raise ValueError(f"Unknown or missing characters: {unknown}")
+        environment = ChatEnvironment(
+            name="Persona Chat",
+            agents=[create_character(dict(config.CHARACTERS[char])) for char in characters],
+            description=description
+        )
+        session_id = uuid.uuid4().hex
+        session = Session(environment, temperature)
+        self.sessions[session_id] = session
+        if self.session_store:
+            await self._save(session_id, session)
+        return session_id
+
+    async def get_session(self, session_id):
+        """Get a session, restoring it from the session store if needed."""
+        session = self.sessions.get(session_id)
+        if session is None and self.session_store:
+            environment, chat_history, metadata = await asyncio.to_thread(
+                self.session_store.load_with_metadata, session_id
+            )
+            # Another request may have restored the session while this one was loading.
+            session = self.sessions.get(session_id)
+            if session is None and environment is not None:
+                session = Session(environment, (metadata or {}).get("temperature", 0.7))
+                session.chat_history = chat_history or []
+                self.sessions[session_id] = session
+        if session is None:
+            raise KeyError(session_id)
+        session.last_used = time.monotonic()
+        return session
+
+    async def _save(self, session_id, session):
+        """Save a session and its settings to the session store."""
+        await asyncio.to_thread(
+            self.session_store.save, session_id, session.environment, session.chat_history,
+            {"temperature": session.temperature}
+        )
+
+    async def delete_session(self, session_id):
+        """Delete a session from memory and from the session store."""
+        session = self.sessions.pop(session_id, None)
+        if self.session_store:
+            await asyncio.to_thread(self.session_store.delete, session_id)
+        elif session is None:
+            raise KeyError(session_id)
+
+    def evict_idle(self):
+        """Drop idle sessions from memory, returning how many were evicted."""
+        idle = [session_id for session_id, session in self.sessions.items() if session.is_idle(self.idle_timeout)]
+        for session_id in idle:
+            del self.sessions[session_id]
+        if idle:
+            logger.info(f"Evicted {len(idle)} idle sessions")
+        return len(idle)
+
+    async def _stream_agent(self, agent, temperature, events):
+        """Stream one agent's response into the shared event queue."""
+        async with self._limiter:
+            self.in_flight += 1
+            try:
+                parts = []
+                async for delta in agent.stream_response(self.client, temperature):
+                    parts.append(delta)
+                    await events.put({"event": "token", "agent": agent.name, "delta": delta})
+                response = "".join(parts)
+                await events.put({
+                    "event": "done",
+                    "agent": agent.name,
+                    "response": response,
+                    "color": agent.config.get("color", "#000000"),
+                    "usage": agent.last_usage
+                })
+            finally:
+                self.in_flight -= 1
+
+    async def stream_turn(self, session_id, message):
+        """Run a turn for every agent concurrently, yielding events as they arrive."""
+        session = await self.get_session(session_id)
+        if self.pending_turns >= self.max_pending_turns:
+            raise ServiceBusy("Too many pending turns")
+        self.pending_turns += 1
+        try:
+            async with session.lock:
+                environment = session.environment
+                environment.deliver_message(message)
+                session.chat_history.append({"role": "user", "content": message})
+                events = asyncio.Queue(maxsize=64)
+                tasks = [
+                    asyncio.create_task(self._stream_agent(agent, session.temperature, events))
+                    for agent in environment.agents
+                ]
+                remaining = len(tasks)
+                try:
+                    while remaining:
+                        event = await events.get()
+                        if event["event"] == "done":
+                            remaining -= 1
+                            session.chat_history.append({
+                                "role": "assistant",
+                                "content": event["response"],
+                                "color": event["color"],
+                                "character_type": event["agent"]
+                            })
+                        yield event
+                finally:
+                    for task in tasks:
+                        task.cancel()
+                    await asyncio.gather(*tasks, return_exceptions=True)
+                if self.session_store and self.sessions.get(session_id) is session:
+                    await self._save(session_id, session)
+        finally:
+            self.pending_turns -= 1
+
+    async def run_turn(self, session_id, message):
+        """Run a turn and return the final responses."""
+        responses = []
+        async for event in self.stream_turn(session_id, message):
+            if event["event"] == "done":
+                responses.append({key: value for key, value in event.items() if key != "event"})
+        return responses
+
+
+async def read_json(request):
+    """Read a JSON object from the request body."""
+    try:
+        body = await request.json()
+    except json.JSONDecodeError:
+        raise web.HTTPBadRequest(text="Request body must be JSON")
+    if not isinstance(body, dict):
+        raise web.HTTPBadRequest(text="Request body must be a JSON object")
+    return body
+
+
+def read_message(body):
+    """Get the user message from a request body."""
+    message = body.get("message")
+    if not isinstance(message, str) or not message:
+        raise web.HTTPBadRequest(text="'message' is required")
+    return message
+
+
+async def create_session(request):
+    service = request.app["service"]
+    body = await read_json(request)
+    characters = body.get("characters", [])
+    if not isinstance(characters, list) or not all(isinstance(char, str) for char in characters):
+        raise web.HTTPBadRequest(text="'characters' must be a list of persona names")
+    try:
+        temperature = float(body.get("temperature", 0.7))
+    except (TypeError, ValueError):
+        raise web.HTTPBadRequest(text="'temperature' must be a number")
+    try:
+        session_id = await service.create_session(characters, str(body.get("description") or ""), temperature)
+    except ValueError as e:
+        raise web.HTTPBadRequest(text=str(e))
+    except ServiceBusy as e:
+        raise web.HTTPServiceUnavailable(text=str(e))
+    return web.json_response({"session_id": session_id}, status=201)
+
+
+async def send_message(request):
+    service = request.app["service"]
+    message = read_message(await read_json(request))
+    try:
+        responses = await service.run_turn(request.match_info["session_id"], message)
+    except KeyError:
+        raise web.HTTPNotFound(text="Unknown session")
+    except ServiceBusy as e:
+        raise web.HTTPServiceUnavailable(text=str(e))
+    return web.json_response({"responses": responses})
+
+
+async def stream_message(request):
+    service = request.app["service"]
+    message = read_message(await read_json(request))
+    session_id = request.match_info["session_id"]
+    try:
+        await service.get_session(session_id)
+    except KeyError:
+        raise web.HTTPNotFound(text="Unknown session")
+    response = web.StreamResponse(headers={"Content-Type": "text/event-stream", "Cache-Control": "no-cache"})
+    await response.prepare(request)
+    try:
+        async for event in service.stream_turn(session_id, message):
+            await response.write(f"event: {event['event']}\ndata: {json.dumps(event)}\n\n".encode("utf-8"))
+        await response.write(b"event: end\ndata: {}\n\n")
+    except ServiceBusy as e:
+        await response.write(f"event: error\ndata: {json.dumps({'error': str(e)})}\n\n".encode("utf-8"))
+    await response.write_eof()
+    return response
+
+
+async def websocket(request):
+    service = request.app["service"]
+    session_id = request.match_info["session_id"]
+    try:
+        await service.get_session(session_id)
+    except KeyError:
+        raise web.HTTPNotFound(text="Unknown session")
+    ws = web.WebSocketResponse(heartbeat=30)
+    await ws.prepare(request)
+    async for msg in ws:
+        if msg.type != WSMsgType.TEXT:
+            continue
+        try:
+            message = read_message(json.loads(msg.data))
+        except (json.JSONDecodeError, AttributeError, web.HTTPBadRequest):
+            await ws.send_json({"event": "error", "error": "Send {\"message\": \"...\"}"})
+            continue
+        try:
+            async for event in service.stream_turn(session_id, message):
+                await ws.send_json(event)
+            await ws.send_json({"event": "end"})
+        except KeyError:
+            await ws.send_json({"event": "error", "error": "Unknown session"})
+            break
+        except ServiceBusy as e:
+            await ws.send_json({"event": "error", "error": str(e)})
+    return ws
+
+
+async def delete_session(request):
+    service = request.app["service"]
+    try:
+        await service.delete_session(request.match_info["session_id"])
+    except KeyError:
+        raise web.HTTPNotFound(text="Unknown session")
+    return web.Response(status=204)
+
+
+async def metrics(request):
+    service = request.app["service"]
+    return web.json_response({
+        "sessions": len(service.sessions),
+        "pending_turns": service.pending_turns,
+        "in_flight": service.in_flight
+    })
+
+
+async def evict_idle_sessions(app):
+    """Periodically evict idle sessions while the app runs."""
+    service = app["service"]
+
+    async def run():
+        while True:
+            await asyncio.sleep(min(60, service.idle_timeout))
+            service.evict_idle()
+
+    task = asyncio.create_task(run())
+    yield
+    task.cancel()
+
+
+def create_app(service):
+    """Create the aiohttp application for a SimulatorService."""
+    app = web.Application()
+    app["service"] = service
+    app.cleanup_ctx.append(evict_idle_sessions)
+    app.router.add_post("/sessions", create_session)
+    app.router.add_post("/sessions/{session_id}/messages", send_message)
+    app.router.add_post("/sessions/{session_id}/stream", stream_message)
+    app.router.add_get("/sessions/{session_id}/ws", websocket)
+    app.router.add_delete("/sessions/{session_id}", delete_session)
+    app.router.add_get("/metrics", metrics)
+    return app
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Persona Simulator HTTP service")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--max-concurrency", type=int, default=32)
+    parser.add_argument("--idle-timeout", type=float, default=1800, help="Seconds before idle sessions are evicted")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    session_store = None
+    if config.SESSION_STORE_DIR:
+        from session_store import FileSessionStore
+        session_store = FileSessionStore(config.SESSION_STORE_DIR)
+    service = SimulatorService(
+        AsyncOpenAI(api_key=os.getenv("OPENAI_API_KEY")),
+        max_concurrency=args.max_concurrency,
+        session_store=session_store,
+        idle_timeout=args.idle_timeout
+    )
+    web.run_app(create_app(service), host=args.host, port=args.port)
+
+
+if __name__ == "__main__":
+    main()
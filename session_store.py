@@ -0,0 +1,304 @@
+"""
+Snapshot and restore of chat environments for multi-worker deployments.
+
+A session is stored as a sequence of binary frames. The first frame is a full
+snapshot of the environment; later frames are deltas that only carry the
+memory and chat history entries appended since the previous save, so saving
+after each turn costs time proportional to the turn, not the session.
+
+Frame layout: 1 byte frame kind, 4 bytes big-endian payload length, then a
+zlib-compressed JSON payload. File stores prefix the frames with MAGIC.
+"""
+import os
+import json
+import zlib
+import re
+import struct
+import logging
+from agent import Agent
+from utils import ChatEnvironment
+
+logger = logging.getLogger(__name__)
+
+FORMAT_VERSION = 1
+MAGIC = b"PSIM" + bytes([FORMAT_VERSION])
+FRAME_HEADER = struct.Struct(">BI")
+FRAME_FULL = 0
+FRAME_DELTA = 1
+SESSION_ID_PATTERN = re.compile(r"^[A-Za-z0-9_-]{1,128}$")
+
+
+def snapshot_agent(agent, memory_start=0):
+    """Serialize an agent, including only memory entries from `memory_start` on."""
+    record = {
+        "name": agent.name,
+        "config": agent.config,
+        "context": agent.context,
+        "context_version": agent.context_version,
+        "memory_start": memory_start,
+        "memory": agent.memory[memory_start:]
+    }
+    if agent.memory_index is not None:
+        record["semantic_memory"] = {
+            "recent_limit": agent.memory_index.recent_limit,
+            "relevant_limit": agent.memory_index.relevant_limit
+        }
+    return record
+
+
+def snapshot_environment(environment, marks=None, chat_history=None, metadata=None):
+    """Serialize an environment.
+
+    `marks` maps agent names (and "chat_history") to the number of entries
+    already stored; only entries past those marks are included. `metadata` is
+    a JSON-serializable dict of session settings stored alongside.
+    """
+    marks = marks or {}
+    snapshot = {
+        "name": environment.name,
+        "description": environment.description,
+        "context_version": environment.context_version,
+        "agents": [snapshot_agent(agent, marks.get(agent.name, 0)) for agent in environment.agents]
+    }
+    if chat_history is not None:
+        start = marks.get("chat_history", 0)
+        snapshot["chat_history_start"] = start
+        snapshot["chat_history"] = chat_history[start:]
+    if metadata is not None:
+        snapshot["metadata"] = metadata
+    return snapshot
+
+
+def restore_agent(record, agent=None):
+    """Rebuild an agent from a record, or extend an existing one with its memory tail."""
+    if agent is None:
+        agent = Agent(record["name"], record["config"])
+    else:
+        agent.config = record["config"]
+    agent.context = record["context"]
+    agent.context_version = record["context_version"]
+    index = agent.memory_index
+    agent.memory = agent.memory[:record["memory_start"]] + record["memory"]
+    if "semantic_memory" not in record:
+        agent.memory_index = None
+    elif index is not None and index.size == record["memory_start"]:
+        index.add(record["memory"])
+    else:
+        # Embeddings are not stored; the index is rebuilt with the default embedder.
+        agent.enable_semantic_memory(**record["semantic_memory"])
+    return agent
+
+
+def apply_snapshot(snapshot, environment=None, chat_history=None):
+    """Apply a full or delta snapshot, returning the environment and chat history."""
+    existing = {agent.name: agent for agent in environment.agents} if environment else {}
+    agents = [restore_agent(record, existing.get(record["name"])) for record in snapshot["agents"]]
+    if environment is None:
+        environment = ChatEnvironment(name=snapshot["name"], agents=agents)
+    else:
+        environment.agents = agents
+    environment.description = snapshot["description"]
+    environment.context_version = snapshot["context_version"]
+    for agent in agents:
+        agent.accessible_agents = []
+    environment.make_everyone_accessible()
+    if "chat_history" in snapshot:
+        chat_history = (chat_history or [])[:snapshot["chat_history_start"]] + snapshot["chat_history"]
+    return environment, chat_history
+
+
+def encode_frame(kind, payload):
+    """Encode a snapshot payload as a binary frame."""
+    data = zlib.compress(json.dumps(payload, separators=(",", ":")).encode("utf-8"))
+    return FRAME_HEADER.pack(kind, len(data)) + data
+
+
+def decode_frames(data):
+    """Decode concatenated binary frames into (kind, payload) pairs."""
+    frames = []
+    offset = 0
+    while offset < len(data):
+        kind, length = FRAME_HEADER.unpack_from(data, offset)
+        offset += FRAME_HEADER.size
+        frames.append((kind, json.loads(zlib.decompress(data[offset:offset + length]))))
+        offset += length
+    return frames
+
+
+def restore_frames(frames):
+    """Rebuild an environment, chat history and the latest metadata from a base frame and its deltas."""
+    environment, chat_history, metadata = None, None, None
+    for kind, payload in frames:
+        if kind == FRAME_FULL:
+            environment, chat_history, metadata = None, None, None
+        environment, chat_history = apply_snapshot(payload, environment, chat_history)
+        metadata = payload.get("metadata", metadata)
+    return environment, chat_history, metadata
+
+
+def current_marks(environment, chat_history=None):
+    """Get the entry counts that a snapshot of the environment covers."""
+    marks = {agent.name: len(agent.memory) for agent in environment.agents}
+    if chat_history is not None:
+        marks["chat_history"] = len(chat_history)
+    return marks
+
+
+class SessionStore:
+    """Base class for session stores.
+
+    Subclasses implement `_write_frame`, `_read_frames` and `delete`. The store
+    remembers what it last saved for each session so that the next save only
+    writes a delta frame; after a restart, or if state was truncated, the first
+    save writes a full frame again. Every `compact_every` deltas a full frame
+    is written so restores do not replay an unbounded chain. Session metadata
+    is written when it changes and carried over into full frames.
+    """
+
+    def __init__(self, compact_every=200):
+        self.compact_every = compact_every
+        self._marks = {}
+        self._deltas = {}
+        self._metadata = {}
+
+    def _needs_full(self, session_id, environment, chat_history):
+        marks = self._marks.get(session_id)
+        if marks is None or self._deltas.get(session_id, 0) >= self.compact_every:
+            return True
+        for agent in environment.agents:
+            if len(agent.memory) < marks.get(agent.name, 0):
+                return True
+        return chat_history is not None and len(chat_history) < marks.get("chat_history", 0)
+
+    def save(self, session_id, environment, chat_history=None, metadata=None):
+        """Save the environment, writing only what changed since the last save.
+
+        `metadata` replaces the session's stored metadata; None keeps it.
+        """
+        previous = self._metadata.get(session_id)
+        if self._needs_full(session_id, environment, chat_history):
+            metadata = metadata if metadata is not None else previous
+            snapshot = snapshot_environment(environment, chat_history=chat_history, metadata=metadata)
+            self._write_frame(session_id, encode_frame(FRAME_FULL, snapshot), reset=True)
+            self._deltas[session_id] = 0
+        else:
+            if metadata == previous:
+                metadata = None
+            snapshot = snapshot_environment(environment, self._marks[session_id], chat_history, metadata)
+            self._write_frame(session_id, encode_frame(FRAME_DELTA, snapshot), reset=False)
+            self._deltas[session_id] += 1
+        self._marks[session_id] = current_marks(environment, chat_history)
+        if metadata is not None:
+            self._metadata[session_id] = metadata
+
+    def load(self, session_id):
+        """Restore a session, returning (environment, chat_history) or (None, None)."""
+        environment, chat_history, _ = self.load_with_metadata(session_id)
+        return environment, chat_history
+
+    def load_with_metadata(self, session_id):
+        """Restore a session, returning (environment, chat_history, metadata) or (None, None, None)."""
+        frames = self._read_frames(session_id)
+        if not frames:
+            return None, None, None
+        environment, chat_history, metadata = restore_frames(frames)
+        self._marks[session_id] = current_marks(environment, chat_history)
+        self._deltas[session_id] = len(frames) - 1
+        if metadata is not None:
+            self._metadata[session_id] = metadata
+        else:
+            self._metadata.pop(session_id, None)
+        return environment, chat_history, metadata
+
+    def _write_frame(self, session_id, frame, reset):
+        raise NotImplementedError
+
+    def _read_frames(self, session_id):
+        raise NotImplementedError
+
+    def delete(self, session_id):
+        raise NotImplementedError
+
+
+class FileSessionStore(SessionStore):
+    """Session store keeping one append-only frame file per session."""
+
+    def __init__(self, directory, compact_every=200):
+        super().__init__(compact_every)
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, session_id):
+        if not SESSION_ID_PATTERN.match(session_id):
+            raise ValueError(f"Invalid session id: {session_id!r}")
+        return os.path.join(self.directory, f"{session_id}.psim")
+
+    def _write_frame(self, session_id, frame, reset):
+        path = self._path(session_id)
+        if reset:
+            # Write the new base next to the old one and swap atomically.
+            with open(path + ".tmp", 'wb') as f:
+                f.write(MAGIC + frame)
+            os.replace(path + ".tmp", path)
+        else:
+            with open(path, 'ab') as f:
+                f.write(frame)
+
+    def _read_frames(self, session_id):
+        try:
+            with open(self._path(session_id), 'rb') as f:
+                data = f.read()
+        except FileNotFoundError:
+            return []
+        if not data.startswith(MAGIC):
+            logger.error(f"Unsupported session file format for {session_id}")
+            return []
+        return decode_frames(data[len(MAGIC):])
+
+    def delete(self, session_id):
+        self._marks.pop(session_id, None)
+        self._deltas.pop(session_id, None)
+        self._metadata.pop(session_id, None)
+        try:
+            os.remove(self._path(session_id))
+        except FileNotFoundError:
+            pass
+
+
+class RedisSessionStore(SessionStore):
+    """Session store on any client with Redis `rpush`, `lrange`, `delete` and `pipeline`."""
+
+    def __init__(self, redis_client, prefix="persona_simulator:session:", ttl=None, compact_every=200):
+        super().__init__(compact_every)
+        self.redis = redis_client
+        self.prefix = prefix
+        self.ttl = ttl
+
+    def _key(self, session_id):
+        return f"{self.prefix}{session_id}"
+
+    def _write_frame(self, session_id, frame, reset):
+        key = self._key(session_id)
+        pipe = self.redis.pipeline()
+        if reset:
+            pipe.delete(key)
+            pipe.rpush(key, bytes([FORMAT_VERSION]))
+        pipe.rpush(key, frame)
+        if self.ttl:
+            pipe.expire(key, self.ttl)
+        pipe.execute()
+
+    def _read_frames(self, session_id):
+        items = self.redis.lrange(self._key(session_id), 0, -1)
+        if not items:
+            return []
+        if items[0] != bytes([FORMAT_VERSION]):
+            logger.error(f"Unsupported session format for {session_id}")
+            return []
+        return decode_frames(b"".join(items[1:]))
+
+    def delete(self, session_id):
+        self._marks.pop(session_id, None)
+        self._deltas.pop(session_id, None)
+        self._metadata.pop(session_id, None)
+        self.redis.delete(self._key(session_id))
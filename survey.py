@@ -0,0 +1,208 @@
+"""
+Synthetic population survey mode.
+
+Respondent personas are sampled in bulk from configurable distributions,
+each is asked the same structured question through the regular
+`Agent`/`create_character` path, and answers are aggregated into counts and
+histograms as they arrive. Respondents are independent agents, so no chat
+environment is built per respondent.
+"""
+import os
+import re
+import json
+import argparse
+from collections import Counter, defaultdict
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+import numpy as np
+import config
+from utils import create_character
+
+INVALID_ANSWER = "(invalid)"
+
+
+def default_population():
+    """Build a population spec from the pooled attributes of `config.CHARACTERS`."""
+    characters = list(config.CHARACTERS.values())
+    ages = [c["age"] for c in characters]
+    return {
+        "age": {"mean": float(np.mean(ages)), "std": float(np.std(ages)) or 10.0, "min": 18, "max": 80},
+        "nationality": dict(Counter(c["nationality"] for c in characters)),
+        "occupation": dict(Counter(c["occupation"] for c in characters)),
+        "traits": [[t["trait"] for c in characters for t in c["personality_traits"]]],
+        "traits_per_pool": 3
+    }
+
+
+def _categorical(rng, weights, size):
+    """Draw `size` values from a {value: weight} mapping."""
+    values = list(weights)
+    p = np.array([weights[v] for v in values], dtype=float)
+    return np.array(values, dtype=object)[rng.choice(len(values), size=size, p=p / p.sum())]
+
+
+def sample_personas(population, size, seed=None, start=0):
+    """Sample `size` respondent character configs from a population spec.
+
+    `population` has an "age" normal distribution (mean, std, min, max),
+    weighted "nationality" and "occupation" mappings, and "traits", a list of
+    trait pools from each of which "traits_per_pool" distinct traits are drawn.
+    """
+    rng = np.random.default_rng(seed)
+    age = population["age"]
+    ages = np.clip(np.rint(rng.normal(age["mean"], age["std"], size)), age["min"], age["max"]).astype(int)
+    nationalities = _categorical(rng, population["nationality"], size)
+    occupations = _categorical(rng, population["occupation"], size)
+    per_pool = population.get("traits_per_pool", 3)
+    trait_columns = []
+    for pool in population["traits"]:
+        pool = np.array(pool, dtype=object)
+        # Distinct traits per respondent: rank a random matrix row-wise.
+        picks = np.argsort(rng.random((size, len(pool))), axis=1)[:, :min(per_pool, len(pool))]
+        trait_columns.append(pool[picks])
+    traits = np.concatenate(trait_columns, axis=1) if trait_columns else np.empty((size, 0), dtype=object)
+    return [
+        {
+            "name": f"Respondent {start + i + 1}",
+            "age": int(ages[i]),
+            "nationality": nationalities[i],
+            "occupation": occupations[i],
+            "personality_traits": [{"trait": trait} for trait in traits[i]]
+        }
+        for i in range(size)
+    ]
+
+
+class SurveyQuestion:
+    """A question with either fixed answer options or an integer scale."""
+
+    def __init__(self, text, options=None, scale=None):
+        if not options and not scale:
+            raise ValueError("A survey question needs options or a scale")
+        self.text = text
+        self.options = list(options) if options else None
+        self.scale = scale
+
+    def prompt(self):
+        """Get the question with its answer format instructions."""
+        if self.options:
+            choices = ", ".join(self.options)
+            return f"{self.text}\nAnswer with exactly one of: {choices}. Reply with the option only."
+        low, high = self.scale
+        return f"{self.text}\nAnswer with a single whole number from {low} to {high}. Reply with the number only."
+
+    def parse(self, response):
+        """Parse a response into a valid answer, or INVALID_ANSWER."""
+        text = (response or "").strip().strip(".!\"'*").lower()
+        if self.options:
+            for option in self.options:
+                if text == option.lower():
+                    return option
+            matches = [o for o in self.options if re.search(rf"\b{re.escape(o.lower())}\b", text)]
+            return matches[0] if len(matches) == 1 else INVALID_ANSWER
+        match = re.search(r"-?\d+", text)
+        if match and self.scale[0] <= int(match.group()) <= self.scale[1]:
+            return int(match.group())
+        return INVALID_ANSWER
+
+
+class SurveyResults:
+    """Streaming aggregation of survey answers."""
+
+    def __init__(self, age_bins=(18, 25, 35, 45, 55, 65, 81)):
+        self.age_bins = np.array(age_bins)
+        self.total = 0
+        self.counts = Counter()
+        self.by_nationality = defaultdict(Counter)
+        self.by_occupation = defaultdict(Counter)
+        self.age_histograms = defaultdict(lambda: np.zeros(len(self.age_bins) - 1, dtype=int))
+
+    def add(self, persona, answer):
+        """Add one respondent's answer."""
+        self.total += 1
+        self.counts[answer] += 1
+        self.by_nationality[persona["nationality"]][answer] += 1
+        self.by_occupation[persona["occupation"]][answer] += 1
+        bucket = np.searchsorted(self.age_bins, persona["age"], side="right") - 1
+        if 0 <= bucket < len(self.age_bins) - 1:
+            self.age_histograms[answer][bucket] += 1
+
+    def shares(self):
+        """Get the share of respondents per answer."""
+        return {answer: count / self.total for answer, count in self.counts.most_common()} if self.total else {}
+
+    def summary(self):
+        """Get a JSON-serializable summary of the results."""
+        return {
+            "total": self.total,
+            "counts": dict(self.counts),
+            "shares": self.shares(),
+            "by_nationality": {k: dict(v) for k, v in self.by_nationality.items()},
+            "by_occupation": {k: dict(v) for k, v in self.by_occupation.items()},
+            "age_bins": self.age_bins.tolist(),
+            "age_histograms": {str(k): v.tolist() for k, v in self.age_histograms.items()}
+        }
+
+
+def ask(persona, question, openai_client, temperature):
+    """Ask one respondent the question and parse the answer."""
+    agent = create_character(persona)
+    agent.listen(question.prompt())
+    response = agent.generate_response(openai_client, temperature)
+    return persona, question.parse(response)
+
+
+def run_survey(question, size, openai_client, population=None, concurrency=16, temperature=0.7,
+               seed=None, chunk_size=1000, on_result=None):
+    """Survey a sampled population with at most `concurrency` requests in flight.
+
+    Personas are sampled in chunks so memory stays bounded for large
+    populations; `on_result(results, persona, answer)` is called as each
+    answer is aggregated.
+    """
+    population = population or default_population()
+    results = SurveyResults()
+    seeds = np.random.SeedSequence(seed).spawn((size + chunk_size - 1) // chunk_size)
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        pending = set()
+        for chunk, chunk_seed in enumerate(seeds):
+            start = chunk * chunk_size
+            for persona in sample_personas(population, min(chunk_size, size - start), chunk_seed, start):
+                if len(pending) >= concurrency * 2:
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        _collect(future, results, on_result)
+                pending.add(pool.submit(ask, persona, question, openai_client, temperature))
+        for future in wait(pending).done:
+            _collect(future, results, on_result)
+    return results
+
+
+def _collect(future, results, on_result):
+    persona, answer = future.result()
+    results.add(persona, answer)
+    if on_result:
+        on_result(results, persona, answer)
+
+
+def main():
+    from openai import OpenAI
+
+    parser = argparse.ArgumentParser(description="Survey a synthetic population of personas")
+    parser.add_argument("question")
+    parser.add_argument("--options", nargs="+", help="Allowed answers")
+    parser.add_argument("--scale", type=int, nargs=2, metavar=("LOW", "HIGH"), help="Integer answer scale")
+    parser.add_argument("--size", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--temperature", type=float, default=0.7)
+    parser.add_argument("--seed", type=int, default=None)
+    args = parser.parse_args()
+
+    question = SurveyQuestion(args.question, args.options, tuple(args.scale) if args.scale else None)
+    client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+    results = run_survey(question, args.size, client, concurrency=args.concurrency,
+                         temperature=args.temperature, seed=args.seed)
+    print(json.dumps(results.summary(), indent=2))
+
+
+if __name__ == "__main__":
+    main()
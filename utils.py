@@ -1,9 +1,17 @@
 """Helper functions for the persona simulator."""
+import os
 import json
+import logging
 import base64
 from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor, wait
 from agent import Agent
 
+logger = logging.getLogger(__name__)
+
+# Shared by all environments for concurrent turns without a hedging policy.
+_executor = ThreadPoolExecutor(max_workers=32, thread_name_prefix="agent-response")
+
 def create_character(character_config):
     """Create an Agent instance from character configuration."""
     person = Agent(character_config["name"], character_config)
@@ -12,7 +20,7 @@ def create_character(character_config):
 def save_chat_history(chat_history, filename):
     """Save chat history to a JSON file."""
     with open(filename, 'w') as f:
-        json.dump(chat_history, f)
+        json.dump(list(chat_history), f)
 
 def load_chat_history(filename):
     """Load chat history from a JSON file."""
@@ -61,6 +69,14 @@ def load_image_url(url):
         print(f"Error loading image from URL: {e}")
         return None
 
+def percentile(values, pct):
+    """Nearest-rank percentile of a list of numbers."""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = max(int(round(pct / 100 * len(ordered) + 0.5)) - 1, 0)
+    return ordered[min(rank, len(ordered) - 1)]
+
 def get_character_image(character_config):
     """Get character image as base64 string."""
     if 'image' in character_config:
@@ -78,12 +94,24 @@ class ChatEnvironment:
         self.agents = agents or []
         self.description = description
         self.current_datetime = datetime.now()
+        self.context_version = 0
         self.make_everyone_accessible()
         
         # Set initial context if provided
         if description:
             self.broadcast_context(description)
             
+    def fork(self, name=None):
+        """Create a branch of the environment sharing all history up to now.
+
+        Agent memories are shared structurally, so forking does not copy
+        history and each branch only stores entries added after the fork.
+        """
+        environment = ChatEnvironment(name=name or self.name, agents=[agent.fork() for agent in self.agents])
+        environment.description = self.description
+        environment.context_version = self.context_version
+        return environment
+
     def add_agent(self, agent):
         """Add an agent to the environment."""
         if agent not in self.agents:
@@ -95,15 +123,28 @@ class ChatEnvironment:
             self.agents.remove(agent)
             
     def broadcast_context(self, context):
-        """Update context for all agents."""
+        """Update context for all agents.
+
+        Each change bumps `context_version`; unchanged descriptions are not
+        re-broadcast.
+        """
+        if context == self.description and self.context_version:
+            return
         self.description = context
+        self.context_version += 1
         for agent in self.agents:
             agent.change_context([
                 f"Current environment/context: {context}",
                 "Consider this context in all your responses and interactions.",
                 f"You are participating in a conversation with {len(self.agents)} other characters.",
                 "Maintain your character's personality and perspective while engaging with others."
-            ])
+            ], version=self.context_version)
+
+    def cache_hit_rate(self):
+        """Get the share of prompt tokens served from the prompt cache across all agents."""
+        prompt_tokens = sum(agent.usage_totals['prompt_tokens'] for agent in self.agents)
+        cached_tokens = sum(agent.usage_totals['cached_tokens'] for agent in self.agents)
+        return cached_tokens / prompt_tokens if prompt_tokens else 0.0
 
     def make_everyone_accessible(self):
         """Make all agents accessible to each other."""
@@ -112,28 +153,80 @@ class ChatEnvironment:
                 if agent != other_agent:
                     agent.make_agent_accessible(other_agent)
 
-    def process_message(self, message, openai_client, temperature=0.7, image_path=None):
-        """Process a message and get responses from all agents."""
+    def deliver_message(self, message, image_path=None):
+        """Deliver a user message (and optional image) to every agent's memory.
+
+        The environment description is not prefixed to the message; agents
+        already carry it in their system prompt. Images are referred to by file
+        name only, so the request does not depend on where the file was saved.
+        """
+        for agent in self.agents:
+            if image_path:
+                agent.see(f"An image was shared: {os.path.basename(image_path)}")
+            agent.listen(message or "")
+
+    def process_message(self, message, openai_client, temperature=0.7, image_path=None,
+                        deadline=None, hedging=None):
+        """Process a message and get responses from all agents.
+
+        With a `deadline` (seconds) or a `hedging` policy, agents respond
+        concurrently; agents that miss the deadline get a placeholder response
+        marked as late.
+        """
         responses = []
         
-        context_prefix = ""
-        if self.description:
-            context_prefix = f"[Context: {self.description}] "
+        self.deliver_message(message, image_path)
+        
+        if deadline is not None or hedging is not None:
+            return self._process_concurrently(openai_client, temperature, deadline, hedging)
         
         for agent in self.agents:
-            if image_path:
-                agent.see(f"An image was shared: {image_path}")
-            
-            # Add context to the message if available
-            full_message = context_prefix + (message or "")
-            agent.listen(full_message)
-            
             response = agent.generate_response(openai_client, temperature)
             if response:
                 responses.append({
                     "agent": agent.name,
                     "response": response,
-                    "color": agent.config.get("color", "#000000")
+                    "color": agent.config.get("color", "#000000"),
+                    "usage": agent.last_usage
                 })
                 
         return responses
+
+    def _process_concurrently(self, openai_client, temperature, deadline, hedging):
+        """Get responses from all agents in parallel, bounded by the deadline.
+
+        Usage is recorded here, only for responses that are used, so calls
+        abandoned at the deadline and losing hedges never touch agent usage.
+        """
+        futures = []
+        for agent in self.agents:
+            call = lambda agent=agent: agent.request_response(openai_client, temperature, timeout=deadline)
+            futures.append(hedging.submit(call) if hedging else _executor.submit(call))
+        wait(futures, timeout=deadline)
+        
+        responses = []
+        for agent, future in zip(self.agents, futures):
+            if future.done() and not future.cancelled():
+                try:
+                    response, messages, usage = future.result()
+                    usage = agent.record_usage(messages, usage)
+                except Exception as e:
+                    logger.error(f"Error generating response: {e}")
+                    response = "I apologize, but I am unable to respond at the moment."
+                    usage = {}
+                if response:
+                    responses.append({
+                        "agent": agent.name,
+                        "response": response,
+                        "color": agent.config.get("color", "#000000"),
+                        "usage": usage
+                    })
+            else:
+                future.cancel()
+                responses.append({
+                    "agent": agent.name,
+                    "response": f"*{agent.name} needs a little more time to think this over.*",
+                    "color": agent.config.get("color", "#000000"),
+                    "late": True
+                })
+        return responses